@@ -0,0 +1,114 @@
+"""
+Microbenchmark rendering a page built from nested includes.
+
+Compares mullendore's native `Template` class with the `wrapt.ObjectProxy`
+wrapper that was previously returned by `Loader.load`.
+
+    python -m benchmarks.nested_includes [depth] [width] [repeat]
+"""
+import jinja2
+import pathlib
+import sys
+import tempfile
+import timeit
+import wrapt
+
+from mullendore.markdown import markdown_to_html
+from mullendore.plugins import plugin_functions
+from mullendore.templates import Environment, Loader
+
+
+class ProxyTemplate(wrapt.ObjectProxy):
+    def __init__(self, *args, **kwargs):
+        wrapt.ObjectProxy.__init__(self, *args, **kwargs)
+        self.metadata = None
+        self.filepath = None
+        self.page = False
+
+    def render(self, **ctx):
+        ctx["store"].setdefault("here", [])
+        ctx["store"]["here"].append(self)
+        previously_in_markdown = ctx["store"].get("in_markdown", False)
+        if self.filename.endswith(".md") and not previously_in_markdown:
+            ctx["store"]["in_markdown"] = True
+            result = self.__wrapped__.render(**ctx)
+            result = markdown_to_html(result, ctx)
+            ctx["store"]["in_markdown"] = False
+        else:
+            result = self.__wrapped__.render(**ctx)
+        ctx["store"]["here"].pop()
+        return result
+
+    def root_render_func(self, ctx):
+        ctx["store"].setdefault("here", [])
+        ctx["store"]["here"].append(self)
+        previously_in_markdown = ctx["store"].get("in_markdown", False)
+        if self.filename.endswith(".md") and not previously_in_markdown:
+            ctx["store"]["in_markdown"] = True
+            result = jinja2.utils.concat(self.__wrapped__.root_render_func(ctx))
+            result = markdown_to_html(result, ctx)
+            ctx["store"]["in_markdown"] = False
+        else:
+            result = jinja2.utils.concat(self.__wrapped__.root_render_func(ctx))
+        ctx["store"]["here"].pop()
+        return result
+
+    def new_context(self, vars=None, shared=False, locals=None):
+        if vars is None:
+            vars = {}
+        return self.__wrapped__.new_context(vars=vars, shared=shared, locals=locals)
+
+
+class ProxyLoader(Loader):
+    @jinja2.utils.internalcode
+    def load(self, *args, **kwargs):
+        template = jinja2.BaseLoader.load(self, *args, **kwargs)
+        template = ProxyTemplate(template)
+        template.filepath, template.metadata = self.loadinfo.pop()
+        return template
+
+
+class ProxyEnvironment(Environment):
+    template_class = jinja2.Template
+
+
+def build_tree(root: pathlib.Path, depth: int, width: int) -> pathlib.Path:
+    """
+    Write a page including `width` partials per level, `depth` levels deep.
+    """
+    for level in range(depth, 0, -1):
+        lines = [f"<p>Level {level} in {{{{ here() }}}}</p>"]
+        if level < depth:
+            lines += [f"{{% include 'level{level + 1}.html' %}}"] * width
+        root.joinpath(f"level{level}.html").write_text("\n".join(lines) + "\n")
+    page = root.joinpath("page.md")
+    page.write_text("# Page\n\n" + "{% include 'level1.html' %}\n" * width)
+    return page
+
+
+def bench(env_class, loader_class, page, repeat):
+    loader = loader_class()
+    loader.set_root_file(page)
+    env = env_class(loader=loader)
+    env.globals.update(plugin_functions)
+    template = env.get_template(str(page))
+
+    def render():
+        template.render(store={})
+
+    render()
+    return min(timeit.repeat(render, number=repeat, repeat=5)) / repeat
+
+
+def main(depth: int = 4, width: int = 4, repeat: int = 50):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        page = build_tree(pathlib.Path(tmpdir), depth, width)
+        proxy = bench(ProxyEnvironment, ProxyLoader, page, repeat)
+        native = bench(Environment, Loader, page, repeat)
+    print(f"nested includes (depth {depth}, width {width})")
+    print(f"  wrapt proxy: {proxy * 1000:.3f} ms/page")
+    print(f"  native:      {native * 1000:.3f} ms/page ({proxy / native:.2f}x)")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
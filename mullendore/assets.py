@@ -0,0 +1,78 @@
+import hashlib
+import html
+import pathlib
+import re
+
+from typing import Dict, Optional
+
+from mullendore.output import FileWriter
+
+
+_html_ref_pattern = re.compile(r'\b(src|href)="([^"#?]+)([^"]*)"')
+
+
+class Assets:
+    """
+    Collects the local files referenced from rendered pages, such as images,
+    and copies them to the mirrored location under `out_dir`.
+
+    With `fingerprint`, the copied files get a hash of their content in their
+    name, and the references to them are rewritten.
+    """
+
+    def __init__(
+        self,
+        root_dir: pathlib.Path,
+        out_dir: pathlib.Path,
+        fingerprint: bool = False,
+    ):
+        self.root_dir = root_dir
+        self.out_dir = out_dir
+        self.fingerprint = fingerprint
+        self.assets: Dict[pathlib.Path, pathlib.Path] = {}
+
+    def collect(self, text: str, page_path: pathlib.Path) -> str:
+        """
+        Register the assets referenced from the HTML `text` of the page at
+        `page_path`, and return the text with rewritten references.
+        """
+
+        def repl(match):
+            attr, ref, rest = match.groups()
+            if "://" in ref or ref.startswith(("data:", "mailto:", "//")):
+                return match.group()
+            if ref.startswith("/"):
+                path = self.root_dir.joinpath(html.unescape(ref).lstrip("/"))
+            else:
+                path = page_path.parent.joinpath(html.unescape(ref))
+            name = self._add(path.resolve())
+            basename = ref.rsplit("/", 1)[-1]
+            if name is None or name == basename:
+                return match.group()
+            return f'{attr}="{ref[: len(ref) - len(basename)]}{name}{rest}"'
+
+        return _html_ref_pattern.sub(repl, text)
+
+    def _add(self, path: pathlib.Path) -> Optional[str]:
+        if path in self.assets:
+            return self.assets[path].name
+        if path.suffix in (".html", ".md") or not path.is_file():
+            return None
+        try:
+            dest = self.out_dir.joinpath(path.relative_to(self.root_dir))
+        except ValueError:
+            return None
+        if self.fingerprint:
+            digest = hashlib.sha256(path.read_bytes()).hexdigest()[:10]
+            dest = dest.with_name(f"{path.stem}.{digest}{path.suffix}")
+        self.assets[path] = dest
+        return dest.name
+
+    def copy(self, writer: FileWriter) -> int:
+        """
+        Copy the collected assets using `writer`.
+
+        Returns:
+            The number of assets copied, not counting unchanged ones.
+        """
+        return sum(1 for src, dest in self.assets.items() if writer.copy(src, dest))
@@ -0,0 +1,76 @@
+import contextlib
+import json
+import pathlib
+import sys
+
+from typing import Dict, TextIO
+
+from mullendore.convert import Converter
+
+
+def run_batch(
+    converter: Converter,
+    root_dir: pathlib.Path,
+    input_fh: TextIO = sys.stdin,
+    output_fh: TextIO = sys.stdout,
+) -> int:
+    """
+    Convert documents read as JSON lines from `input_fh` and write the results
+    as JSON lines to `output_fh`, reusing the same warm converter.
+
+    Each request is an object with either `markdown` (the document text) or
+    `path` (a file to read), and optionally `id`, `template` and `metadata`.
+    When `markdown` is given, `path` is only used to resolve includes and
+    references. Each response has the `id` of the request and either `html` or
+    `error`.
+
+    Returns:
+        The number of failed requests.
+    """
+    failures = 0
+    for line in input_fh:
+        if not line.strip():
+            continue
+        response: Dict = {}
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("request is not a JSON object")
+            response["id"] = request.get("id")
+            # Keep template output such as debug() off the response stream
+            with contextlib.redirect_stdout(sys.stderr):
+                response["html"] = convert_request(converter, root_dir, request)
+        except Exception as e:
+            # Any error in a plugin or processor only fails its own request
+            response["error"] = str(e) or type(e).__name__
+            failures += 1
+        output_fh.write(json.dumps(response) + "\n")
+        output_fh.flush()
+    return failures
+
+
+def convert_request(converter: Converter, root_dir: pathlib.Path, request: Dict) -> str:
+    """
+    Render the document of a single batch request to HTML.
+    """
+    if "markdown" in request:
+        path = root_dir.joinpath(request.get("path") or "stdin.md").resolve()
+        converter.loader.add_source(path, request["markdown"])
+    elif "path" in request:
+        path = root_dir.joinpath(request["path"]).resolve()
+    else:
+        raise ValueError("request has neither `markdown` nor `path`")
+    try:
+        page = converter.get_template(path)
+        ctx_vars = dict(page.metadata)
+        ctx_vars.update(request.get("metadata") or {})
+        return converter.render(
+            path,
+            template_name=request.get("template"),
+            root_dir=root_dir,
+            common_prefix=pathlib.Path(),
+            pages={},
+            **ctx_vars,
+        )
+    finally:
+        converter.loader.remove_source(path)
@@ -0,0 +1,161 @@
+import hashlib
+import json
+import os
+import pathlib
+import tempfile
+
+from typing import Dict, Iterable, List, Optional
+
+
+# Default size limit of the build cache in bytes
+DEFAULT_MAX_SIZE = 500 * 1024 * 1024
+
+_package_dir = pathlib.Path(__file__).resolve().parent
+_code_digest = None
+
+
+def code_digest() -> str:
+    """
+    Return a digest of the mullendore package, including its templates and
+    styles, which changes with every version.
+    """
+    global _code_digest
+    if _code_digest is None:
+        digest = hashlib.sha1()
+        for path in sorted(_package_dir.rglob("*")):
+            if path.is_file() and path.suffix in (".py", ".html", ".css", ".md"):
+                digest.update(path.relative_to(_package_dir).as_posix().encode())
+                digest.update(path.read_bytes())
+        _code_digest = digest.hexdigest()
+    return _code_digest
+
+
+def digest(*parts) -> str:
+    """
+    Return a digest of `parts`, which must be serializable as JSON, with any
+    other values, like paths and dates, as strings.
+    """
+    data = json.dumps(parts, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha1(data.encode()).hexdigest()
+
+
+class BuildCache:
+    """
+    Content addressed cache of rendered pages, stored as files in `path`, which
+    can be shared between builds and machines.
+
+    A page is looked up in two steps. The key of the page, from what is known
+    before rendering it, leads to the list of files the page was rendered from
+    last time, like includes and templates, with their digests. If the files
+    still have the same contents, the rendered page is stored under the digest
+    of the key and the files. Files in `root_dir` are listed by relative path,
+    and files in the mullendore package are covered by `code_digest`.
+
+    The least recently used entries are removed when the cache grows beyond
+    `max_size` bytes.
+    """
+
+    def __init__(
+        self,
+        path: pathlib.Path,
+        root_dir: pathlib.Path,
+        max_size: int = DEFAULT_MAX_SIZE,
+    ):
+        self.path = path
+        self.root_dir = root_dir
+        self.max_size = max_size
+        self.digests: Dict[str, Optional[str]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def _file_digest(self, name: str) -> Optional[str]:
+        if name not in self.digests:
+            try:
+                data = self.root_dir.joinpath(name).read_bytes()
+                self.digests[name] = hashlib.sha1(data).hexdigest()
+            except OSError:
+                self.digests[name] = None
+        return self.digests[name]
+
+    def _names(self, paths: Iterable[pathlib.Path]) -> List[str]:
+        names = set()
+        for path in paths:
+            path = pathlib.Path(path).resolve()
+            if _package_dir in path.parents:
+                continue
+            try:
+                names.add(path.relative_to(self.root_dir).as_posix())
+            except ValueError:
+                names.add(str(path))
+        return sorted(names)
+
+    def _entry_key(self, key: str, names: List[str]) -> Optional[str]:
+        digests = [self._file_digest(name) for name in names]
+        if None in digests:
+            return None
+        return digest(key, names, digests)
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Return the page stored under `key`, if its files are unchanged.
+        """
+        text = None
+        try:
+            names = json.loads(self.path.joinpath(f"{key}.json").read_text())
+            entry_key = self._entry_key(key, names)
+            if entry_key:
+                entry_path = self.path.joinpath(f"{entry_key}.html")
+                text = entry_path.read_text(encoding="utf-8")
+                # Modification times order the entries by last use
+                os.utime(entry_path)
+                os.utime(self.path.joinpath(f"{key}.json"))
+        except (OSError, ValueError):
+            pass
+        if text is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return text
+
+    def set(self, key: str, text: str, dependencies: Iterable[pathlib.Path]):
+        """
+        Store the page `text` rendered from the files `dependencies` under `key`.
+        """
+        names = self._names(dependencies)
+        entry_key = self._entry_key(key, names)
+        if not entry_key:
+            return
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._write(f"{entry_key}.html", text)
+        self._write(f"{key}.json", json.dumps(names))
+
+    def _write(self, name: str, text: str):
+        # Replace files atomically, since other builds may read them
+        fd, tmp_name = tempfile.mkstemp(dir=self.path, prefix=".tmp-")
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            fh.write(text)
+        os.replace(tmp_name, self.path.joinpath(name))
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits its size.
+        """
+        try:
+            entries = []
+            for entry in os.scandir(self.path):
+                if entry.is_file() and not entry.name.startswith("."):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.name, stat.st_size))
+        except FileNotFoundError:
+            return
+        size = sum(entry_size for _, _, entry_size in entries)
+        for _, name, entry_size in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                self.path.joinpath(name).unlink()
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+            self.evicted += 1
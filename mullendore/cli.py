@@ -1,17 +1,39 @@
 import click
+import json
 import os
 import pathlib
+import yaml
 
-from mullendore.convert import Converter
+from mullendore.batch import run_batch
+from mullendore.convert import Converter, SharedCaches
+from mullendore.markdown import preprocessors, postprocessors, processor_stats
+from mullendore.shard import (
+    build_manifest,
+    merge_manifests,
+    parse_shard,
+    partition,
+    read_timings,
+)
+
+from mullendore.timings import regressions, save_timings, slowest
 
 # from mullendore.markdown import get_markdown_metadata
 from mullendore.types import Metadata, abspath
 
-from typing import List, Mapping
+from typing import List, Mapping, Optional, Tuple
 
 AllMetadata = Mapping[pathlib.Path, Metadata]
 
 
+def shard_option(ctx, param, value: Optional[str]) -> Optional[Tuple[int, int]]:
+    if value is None:
+        return None
+    try:
+        return parse_shard(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
 @click.command()
 @click.argument("args", nargs=-1, type=abspath)
 @click.option(
@@ -38,6 +60,39 @@ AllMetadata = Mapping[pathlib.Path, Metadata]
         "with the suffix changed to `.html`."
     ),
 )
+@click.option(
+    "--split-sections",
+    is_flag=True,
+    help=(
+        "Write each top-level section of the pages to its own file, linked from "
+        "the page. Pages can also set `split-sections` in their metadata, to "
+        "true or the header level to split at."
+    ),
+)
+@click.option(
+    "--minify",
+    is_flag=True,
+    help=(
+        "Collapse whitespace and remove comments in the output, except in "
+        "`pre`, `code`, `textarea`, `script` and `style` elements."
+    ),
+)
+@click.option(
+    "--out-dir",
+    type=abspath,
+    help=(
+        "Directory where to write the output, mirroring the tree under the root. "
+        "Local files referenced from the pages are copied there as well."
+    ),
+)
+@click.option(
+    "--fingerprint-assets",
+    is_flag=True,
+    help=(
+        "With --out-dir, add a hash of the content to the names of copied "
+        "assets and rewrite the references to them."
+    ),
+)
 @click.option(
     "-s",
     "--style",
@@ -73,6 +128,163 @@ AllMetadata = Mapping[pathlib.Path, Metadata]
     help="Header level used for references.",
     multiple=True,
 )
+@click.option(
+    "--git-metadata",
+    is_flag=True,
+    help=(
+        "Add `last_modified`, `last_commit` and `authors` from the git history "
+        "to the metadata of each page."
+    ),
+)
+@click.option(
+    "--search-index",
+    type=abspath,
+    help=(
+        "Directory where to write a sharded search index of the converted pages."
+    ),
+)
+@click.option(
+    "--shard",
+    callback=shard_option,
+    help=(
+        "Only convert shard `i/N` of the pages, e.g. `2/4`. Metadata is still "
+        "read from all pages."
+    ),
+)
+@click.option(
+    "--shard-timings",
+    type=abspath,
+    help=(
+        "Path to a manifest from a previous build, used to balance the shards by "
+        "page render time."
+    ),
+)
+@click.option(
+    "--timings",
+    type=abspath,
+    help=(
+        "Path of a file where page render times are kept between builds. Pages "
+        "are converted slowest first, shards are balanced by it unless "
+        "`--shard-timings` is given, and the slowest pages and pages that got "
+        "slower are reported."
+    ),
+)
+@click.option(
+    "--manifest",
+    type=abspath,
+    help=(
+        "Path where to write a JSON manifest of the converted pages. Manifests "
+        "from sharded builds can be combined with `mullendore-merge`."
+    ),
+)
+@click.option(
+    "--output-archive",
+    type=abspath,
+    help=(
+        "Write all output into this `.zip` or `.tar.gz` archive instead of the "
+        "file system, with paths relative to the root."
+    ),
+)
+@click.option(
+    "--image-attributes",
+    is_flag=True,
+    help=(
+        "Add `width` and `height` read from the image files, and lazy loading "
+        "attributes, to images."
+    ),
+)
+@click.option(
+    "--image-cache",
+    type=abspath,
+    help="Path of a file where to cache image sizes between builds.",
+)
+@click.option(
+    "--fragment-cache",
+    type=abspath,
+    help=(
+        "Directory where to store fragments rendered by `{% cache %}` blocks "
+        "between builds. By default they are only kept during the build."
+    ),
+)
+@click.option(
+    "--build-cache",
+    type=abspath,
+    help=(
+        "Directory of a cache of rendered pages, keyed by their contents and "
+        "everything they are rendered from, which can be shared between builds "
+        "and machines."
+    ),
+)
+@click.option(
+    "--build-cache-size",
+    type=int,
+    help="Size limit of the build cache in MB. The default is 500 MB.",
+)
+@click.option(
+    "--check-links",
+    is_flag=True,
+    help=(
+        "Check that internal links point to existing pages, files and anchors, "
+        "and report the broken ones."
+    ),
+)
+@click.option(
+    "--processor-stats",
+    is_flag=True,
+    help="Report how often each Markdown processor ran or was skipped.",
+)
+@click.option(
+    "--profile-templates",
+    type=abspath,
+    help=(
+        "Sample the stack while rendering and write it as collapsed stacks for "
+        "flame graphs to this path, and report the hottest template lines."
+    ),
+)
+@click.option(
+    "--context-usage",
+    is_flag=True,
+    help=(
+        "Report how many page renderings used the reference index and each "
+        "value of the page store, like the TOC, which are computed on demand."
+    ),
+)
+@click.option(
+    "--memory-report",
+    type=abspath,
+    help=(
+        "Trace memory allocations and write the peak memory of each page and "
+        "conversion stage to this path as JSON, and report the largest ones."
+    ),
+)
+@click.option(
+    "--pipeline",
+    is_flag=True,
+    help=(
+        "Read page sources ahead in background threads and write the output "
+        "from a background thread while rendering."
+    ),
+)
+@click.option(
+    "--batch",
+    is_flag=True,
+    help=(
+        "Read JSON lines requests with Markdown text or paths from stdin and write "
+        "the rendered HTML as JSON lines to stdout."
+    ),
+)
+@click.option(
+    "--sites",
+    type=abspath,
+    help=(
+        "Path to a YAML file with a list of `sites` to build in one process. "
+        "Each site has its input `args` and the options that differ from the "
+        "command line, with paths relative to the file. Templates outside the "
+        "site roots, like the built-in ones, are compiled once for all sites, "
+        "sites with the same root share their templates and page metadata, "
+        "and references are shared between sites with the same options."
+    ),
+)
 @click.option(
     "--encoding", type=str, default="utf-8", help="Encoding used in the files."
 )
@@ -80,18 +292,166 @@ def main(args: List[str], **options):
     """
     Convert Markdown files to HTML using Jinja templates.
     """
-    if not args:
+    if options["sites"]:
+        shared = SharedCaches()
+        failed = False
+        for site_args, site_options in read_sites(options["sites"], options):
+            click.echo(f"{site_options['root']}:")
+            failed = build(site_args, site_options, shared) or failed
+        if failed:
+            raise SystemExit(1)
+        return
+    if build(args, options):
+        raise SystemExit(1)
+
+
+def build(
+    args: List[pathlib.Path], options: dict, shared: Optional[SharedCaches] = None
+) -> bool:
+    """
+    Build a site with the given options.
+
+    Returns:
+        Whether the build failed.
+    """
+    if not args and not options["batch"]:
         raise click.UsageError("No input files given.")
     root_dir = options["root"]
-    converter = Converter(options)
+    try:
+        converter = Converter(options, shared)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="'--output-archive'")
+    if options["batch"]:
+        failures = run_batch(converter, root_dir)
+        converter.close()
+        return bool(failures)
     paths = resolve_paths(args, root_dir, options["recursive"])
     if len(paths) <= 1:
         common_prefix = paths[0].parent.relative_to(root_dir)
     else:
         common_prefix = pathlib.Path(os.path.commonprefix(paths)).relative_to(root_dir)
-    converter.convert_all(
-        paths, root_dir=root_dir, common_prefix=common_prefix, store=dict()
-    )
+    selected = None
+    if options["shard"]:
+        timings = converter.previous_timings or None
+        if options["shard_timings"]:
+            timings = read_timings(options["shard_timings"])
+        selected = set(partition(paths, root_dir, *options["shard"], timings=timings))
+    try:
+        output_paths = converter.convert_all(
+            paths,
+            selected=selected,
+            root_dir=root_dir,
+            common_prefix=common_prefix,
+            store=dict(),
+        )
+    finally:
+        converter.close()
+    if converter.write_errors:
+        return True
+    if options["processor_stats"]:
+        echo_processor_stats()
+    if options["manifest"] and output_paths is not None:
+        converted = [path for path in paths if selected is None or path in selected]
+        manifest = build_manifest(
+            options["shard"],
+            root_dir,
+            dict(zip(converted, output_paths)),
+            converter.page_timings(root_dir),
+            options["out_dir"],
+        )
+        options["manifest"].write_text(json.dumps(manifest, indent=2))
+    if options["timings"]:
+        echo_timings(converter.previous_timings, converter.timings, root_dir)
+        save_timings(
+            options["timings"], root_dir, converter.previous_timings, converter.timings
+        )
+    return bool(converter.broken_links)
+
+
+def read_sites(
+    config_path: pathlib.Path, options: dict
+) -> List[Tuple[List[pathlib.Path], dict]]:
+    """
+    Read the site definitions of a `--sites` file. Each site has the input
+    `args` and options that override those of the command line, with paths
+    relative to the file.
+    """
+    ctx = click.get_current_context()
+    params = {param.name: param for param in ctx.command.params}
+    base_dir = config_path.parent
+    config = yaml.safe_load(config_path.read_text()) or {}
+    sites = []
+    for i, site in enumerate(config.get("sites") or [], 1):
+        site = dict(site)
+        args = [abspath(base_dir / arg) for arg in site.pop("args", [])]
+        site_options = dict(options, sites=None)
+        for key, value in site.items():
+            name = key.replace("-", "_")
+            param = params.get(name)
+            if param is None or name in ("args", "sites"):
+                raise click.BadParameter(
+                    f"site {i}: no such option '{key}'", param_hint="'--sites'"
+                )
+            values = value if isinstance(value, list) else [value]
+            if getattr(param.type, "func", None) is abspath:
+                values = [base_dir / value for value in values]
+            value = param.type_cast_value(ctx, values if param.multiple else values[0])
+            if param.callback:
+                value = param.callback(ctx, param, value)
+            site_options[name] = value
+        sites.append((args, site_options))
+    return sites
+
+
+def echo_timings(
+    previous: Mapping[str, float],
+    timings: Mapping[pathlib.Path, float],
+    root_dir: pathlib.Path,
+):
+    current = {
+        path.relative_to(root_dir).as_posix(): time for path, time in timings.items()
+    }
+    click.echo("Slowest pages:")
+    for name, time in slowest(current):
+        click.echo(f"{time:8.2f} s  {name}")
+    slower = regressions(previous, current)
+    if slower:
+        click.echo("Slower than the previous build:")
+        for name, before, time in slower:
+            click.echo(f"{before:8.2f} s -> {time:.2f} s  {name}")
+
+
+def echo_processor_stats():
+    for func in preprocessors + postprocessors:
+        stats = processor_stats[func.__name__]
+        click.echo(
+            f"{func.__name__}: ran {stats['ran']}, skipped {stats['skipped']}, "
+            f"disabled {stats['disabled']}"
+        )
+
+
+@click.command()
+@click.argument("manifests", nargs=-1, type=abspath)
+@click.option(
+    "-o",
+    "--output",
+    type=abspath,
+    help="Path where to write the merged manifest. By default it is printed.",
+)
+def merge(manifests: List[pathlib.Path], output: Optional[pathlib.Path]):
+    """
+    Validate and combine the manifests written by sharded builds.
+    """
+    if not manifests:
+        raise click.UsageError("No manifests given.")
+    try:
+        merged = merge_manifests(json.loads(path.read_text()) for path in manifests)
+    except (OSError, ValueError, KeyError) as e:
+        raise click.ClickException(str(e))
+    if output:
+        output.write_text(json.dumps(merged, indent=2))
+    else:
+        click.echo(json.dumps(merged, indent=2))
 
 
 def resolve_paths(
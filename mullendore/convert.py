@@ -1,4 +1,7 @@
 import click
+import collections
+import contextlib
+import json
 import os
 import jinja2
 import pathlib
@@ -6,40 +9,198 @@ import re
 import time
 import yaml
 
-from typing import Union, Dict, List, Tuple, Iterable
-
+from types import CodeType
+from typing import (
+    Union,
+    Dict,
+    List,
+    Tuple,
+    Iterable,
+    Optional,
+    Collection,
+    Set,
+    Counter,
+)
+
+from mullendore.assets import Assets
+from mullendore.cache import DEFAULT_MAX_SIZE, BuildCache, code_digest, digest
+from mullendore.git import GitRepo
+from mullendore.images import ImageSizeCache
+from mullendore.links import LinkChecker
 from mullendore.markdown import markdown_to_html
+from mullendore.memory import MemoryTracker
+from mullendore.minify import minify_html
+from mullendore.output import QueuedWriter, open_writer
+from mullendore.pages import PageIndex
 from mullendore.plugins import plugin_functions, plugin_filters
-from mullendore.templates import Loader, Environment
-from mullendore.types import Metadata
-
+from mullendore.profiler import TemplateProfiler
+from mullendore.search import SearchIndex
+from mullendore.split import SplitPage, section_files, split_level
+from mullendore.templates import (
+    Environment,
+    FragmentCache,
+    FragmentCacheExtension,
+    Loader,
+)
+from mullendore.timings import load_timings, order_by_cost
+from mullendore.types import Metadata, PageStore
+
+
+# Number of pages whose sources are read ahead with the pipeline option
+PREFETCH_COUNT = 16
+
+# Options that change the rendered pages, and are part of their cache keys
+CACHE_KEY_OPTIONS = (
+    "template",
+    "no_template",
+    "style",
+    "minify",
+    "image_attributes",
+    "reference_level",
+    "encoding",
+)
+
+# Number of lines in the summary of the template profile
+PROFILE_TOP_LINES = 20
+# Number of pages and allocation sites in the summary of the memory report
+MEMORY_TOP_COUNT = 10
 
 ReferencesMetadata = Dict[str, Tuple[str, pathlib.Path, str]]
 References = Tuple[re.Pattern, ReferencesMetadata]
 
 
+class SharedCaches:
+    """
+    Caches shared by the converters of several sites built in one process.
+
+    Converters with the same root, encoding and environment variable option
+    share the Jinja environment, and with it the compiled templates and the
+    metadata of the pages. The Jinja template cache is keyed by template name,
+    which is resolved against the directory of the page, so sites with other
+    roots get their own environment. They still share the compiled code of
+    templates outside their roots, like the built-in templates, keyed by the
+    resolved path and source. Reference documents are only indexed once for
+    the same root and options.
+    """
+
+    def __init__(self):
+        self.environments: Dict[Tuple, Environment] = {}
+        self.template_code: Dict[Tuple[pathlib.Path, str, str], CodeType] = {}
+        self.references: Dict[Tuple, References] = {}
+
+
 class Converter:
     """
     Worker class for converting files according to options it was created with.
     """
 
-    def __init__(self, options: dict):
+    def __init__(self, options: dict, shared: Optional["SharedCaches"] = None):
         self.options = options
         self.encoding = options.get("encoding")
-        self.loader = Loader(encoding=self.encoding)
-        self.env = Environment(loader=self.loader)
-        self.env.globals.update(plugin_functions)
-        self.env.filters.update(plugin_filters)
-        if options["env"]:
-            self.env.globals.update(os.environ)
-        if options["reference"]:
-            self.references = self._build_references(
-                options["reference"],
+        self.timings: Dict[pathlib.Path, float] = {}
+        self.cached_pages: Set[pathlib.Path] = set()
+        self.broken_links = 0
+        self.out_dir = options.get("out_dir")
+        self.writer = open_writer(
+            options.get("output_archive"),
+            self.out_dir or options["root"],
+            self.encoding,
+        )
+        if options.get("pipeline"):
+            self.writer = QueuedWriter(self.writer)
+        self.output_pages: Dict[pathlib.Path, pathlib.Path] = {}
+        self.write_errors = 0
+        if self.out_dir:
+            self.assets = Assets(
+                options["root"], self.out_dir, options.get("fingerprint_assets")
+            )
+        else:
+            self.assets = None
+        env_key = (options["root"], self.encoding, bool(options["env"]))
+        if shared and env_key in shared.environments:
+            self.env = shared.environments[env_key]
+            self.loader = self.env.loader
+            # Fragments may depend on the site, so they are not shared
+            self.env.fragment_cache = FragmentCache()
+        else:
+            self.loader = Loader(encoding=self.encoding)
+            self.loader.site_root = options["root"].resolve()
+            if shared:
+                self.loader.code_cache = shared.template_code
+            self.env = Environment(
+                loader=self.loader, extensions=[FragmentCacheExtension]
+            )
+            self.env.globals.update(plugin_functions)
+            self.env.filters.update(plugin_filters)
+            if options["env"]:
+                self.env.globals.update(os.environ)
+            if shared:
+                shared.environments[env_key] = self.env
+        self.env.fragment_cache.path = options.get("fragment_cache")
+        self.shared = shared
+        self._references: Optional[References] = None
+        self.context_usage: Counter[str] = collections.Counter()
+        self.renders = 0
+        if options.get("image_attributes"):
+            self.image_sizes = ImageSizeCache(options.get("image_cache"))
+        else:
+            self.image_sizes = None
+        if options.get("check_links"):
+            self.link_checker = LinkChecker(options["root"])
+        else:
+            self.link_checker = None
+        if options.get("search_index"):
+            self.search_index = SearchIndex(options["root"])
+        else:
+            self.search_index = None
+        if options.get("build_cache"):
+            self.build_cache = BuildCache(
+                options["build_cache"],
                 options["root"],
-                options["reference_level"] or [2],
+                (options.get("build_cache_size") or 0) * 1024 * 1024
+                or DEFAULT_MAX_SIZE,
             )
         else:
-            self.references = None
+            self.build_cache = None
+        self.site_digest = ""
+        if options.get("timings"):
+            self.previous_timings = load_timings(options["timings"])
+        else:
+            self.previous_timings = {}
+        if options.get("profile_templates"):
+            self.profiler = TemplateProfiler(options["root"])
+        else:
+            self.profiler = None
+        if options.get("memory_report"):
+            self.memory = MemoryTracker(options["root"])
+        else:
+            self.memory = None
+
+    @property
+    def references(self) -> Optional[References]:
+        """
+        Index of the reference document, built when first needed.
+        """
+        options = self.options
+        if self._references is None and options["reference"]:
+            levels = tuple(options["reference_level"] or [2])
+            references_key = (
+                options["reference"],
+                options["root"],
+                levels,
+                self.encoding,
+                bool(options.get("split_sections")),
+            )
+            shared = self.shared
+            if shared and references_key in shared.references:
+                self._references = shared.references[references_key]
+            else:
+                self._references = self._build_references(
+                    options["reference"], options["root"], levels
+                )
+                if shared:
+                    shared.references[references_key] = self._references
+        return self._references
 
     def get_template(self, path: Union[str, pathlib.Path]) -> jinja2.Template:
         """
@@ -56,7 +217,12 @@ class Converter:
         """
         return self.env.get_template(str(path))
 
-    def convert_all(self, paths: List[pathlib.Path], **ctx_vars) -> List[pathlib.Path]:
+    def convert_all(
+        self,
+        paths: List[pathlib.Path],
+        selected: Optional[Collection[pathlib.Path]] = None,
+        **ctx_vars,
+    ) -> List[pathlib.Path]:
         """
         Convert a list of paths.
 
@@ -66,6 +232,8 @@ class Converter:
 
         Args:
             paths: List of paths to convert.
+            selected: If given, only convert these of the paths. The metadata of
+                all paths is still made available to the templates.
             ctx_vars: Dict of variables available to the templates.
 
         Returns:
@@ -76,23 +244,80 @@ class Converter:
         """
         ctx_vars["pages"] = pages = {}
         try:
-            for path in paths:
-                template = self.get_template(path)
-                template.page = True
-                pages[path] = template
-                # Update template metadata to inherit from parent index.md pages
-                parent = path.parent.parent if path.name == "index.md" else path.parent
-                while parent.stem and parent / "index.md" not in pages:
-                    parent = parent.parent
-                if parent / "index.md" in pages:
-                    template.metadata = pages[parent / "index.md"].metadata.new_child(
-                        template.metadata
-                    )
-                else:
-                    template.metadata = Metadata(template.metadata)
-            return [
-                self.convert(path, **ctx_vars, **pages[path].metadata) for path in paths
-            ]
+            with self._memory_stage("metadata"):
+                for i, path in enumerate(paths):
+                    if self.options.get("pipeline"):
+                        self.loader.prefetch(paths[i + 1 : i + 1 + PREFETCH_COUNT])
+                    template = self.get_template(path)
+                    template.page = True
+                    pages[path] = template
+                    # Update template metadata to inherit from parent index.md pages
+                    parent = path.parent
+                    if path.name == "index.md":
+                        parent = parent.parent
+                    while parent.stem and parent / "index.md" not in pages:
+                        parent = parent.parent
+                    # The template may already have been used by an earlier build
+                    # with a shared environment, so start from its own metadata
+                    metadata = template.metadata
+                    if isinstance(metadata, Metadata):
+                        metadata = metadata.maps[0]
+                    if parent / "index.md" in pages:
+                        parent_metadata = pages[parent / "index.md"].metadata
+                        template.metadata = parent_metadata.new_child(metadata)
+                    else:
+                        template.metadata = Metadata(metadata)
+            if self.options.get("git_metadata"):
+                self._add_git_metadata(pages)
+            ctx_vars["page_index"] = PageIndex(pages)
+            if self.build_cache:
+                # Pages can list the metadata of any other page
+                root_dir = ctx_vars["root_dir"]
+                self.site_digest = digest(
+                    [
+                        (path.relative_to(root_dir), dict(template.metadata))
+                        for path, template in pages.items()
+                    ]
+                )
+            if self.link_checker:
+                self.link_checker.add_pages(paths)
+            if self.image_sizes:
+                self.image_sizes.prefetch_sources(
+                    [path for path in paths if selected is None or path in selected],
+                    ctx_vars["root_dir"],
+                )
+            # All metadata is known, so the pages can be converted in any order
+            converted = [path for path in paths if selected is None or path in selected]
+            outputs = {
+                path: self.convert(path, **ctx_vars, **pages[path].metadata)
+                for path in order_by_cost(
+                    converted, ctx_vars["root_dir"], self.previous_timings
+                )
+            }
+            output_paths = [outputs[path] for path in converted]
+            if self.search_index:
+                self.search_index.write(self.options["search_index"], self.writer)
+            plain = sum(1 for template in pages.values() if template.plain)
+            if plain:
+                click.echo(f"{plain} of {len(pages)} pages without template syntax")
+            cache = self.env.fragment_cache
+            if cache.hits or cache.misses:
+                click.echo(f"Fragment cache: {cache.hits} hits, {cache.misses} misses")
+            if self.build_cache:
+                self.build_cache.evict()
+                click.echo(
+                    f"Build cache: {self.build_cache.hits} hits, "
+                    f"{self.build_cache.misses} misses, "
+                    f"{self.build_cache.evicted} evicted"
+                )
+            if self.link_checker:
+                self.report_broken_links()
+            if self.assets:
+                copied = self.assets.copy(self.writer)
+                click.echo(
+                    f"{copied} of {len(self.assets.assets)} referenced assets copied"
+                )
+            return output_paths
         except jinja2.exceptions.TemplateNotFound as e:
             click.echo(f"{path}: no template found named '{e}'", err=True)
         except jinja2.exceptions.TemplateSyntaxError as e:
@@ -100,6 +325,12 @@ class Converter:
         except jinja2.exceptions.TemplateError as e:
             click.echo(f"{path}: {e}", err=True)
 
+    def _memory_page(self, path: pathlib.Path):
+        return self.memory.page(path) if self.memory else contextlib.nullcontext()
+
+    def _memory_stage(self, name: str):
+        return self.memory.stage(name) if self.memory else contextlib.nullcontext()
+
     def convert(self, input_path: pathlib.Path, **ctx_vars) -> pathlib.Path:
         """
         Convert a Markdown file to a HTML and render its templates.
@@ -116,21 +347,204 @@ class Converter:
         """
 
         starttime = time.time()
+        page_path = input_path
 
         root_dir = ctx_vars["root_dir"]
 
         click.echo(f"{input_path.relative_to(root_dir)}...", nl=False)
 
+        input_path = input_path.resolve()
+
+        if self.options["output"]:
+            output_path = self.options["output"]
+        elif self.out_dir:
+            output_path = self.out_dir.joinpath(
+                input_path.relative_to(root_dir).with_suffix(".html")
+            )
+        else:
+            output_path = input_path.with_suffix(".html")
+
+        with self._memory_page(input_path):
+            change_data: Optional[Dict] = None
+            if ctx_vars.get("show-changes-data") == "sidecar":
+                change_data = ctx_vars["change_data"] = {}
+
+            split = self.options.get("split_sections") or ctx_vars.get(
+                "split-sections"
+            )
+            sections = ""
+            cached = False
+            if split:
+                split_page = SplitPage(
+                    output_path,
+                    None if split is True else int(split),
+                    ctx_vars.get("title"),
+                )
+                ctx_vars["split_page"] = split_page
+                text = self.render(input_path, **ctx_vars)
+                self._write_output(page_path, output_path, text)
+                for i, path in enumerate(split_page.paths[1:], 1):
+                    split_page.current = i
+                    text = self.render(input_path, **ctx_vars)
+                    self._write_output(page_path, path, text, path.name)
+                if len(split_page.paths) > 1:
+                    sections = f", {len(split_page.paths)} files"
+            else:
+                text, cached = self._render_cached(input_path, ctx_vars)
+                self._write_output(page_path, output_path, text)
+            if change_data:
+                self.writer.write(
+                    output_path.with_name(f"{input_path.stem}.changes.json"),
+                    json.dumps(change_data),
+                )
+
+        elapsed = time.time() - starttime
+        # Pages from the build cache keep the timings of their last rendering
+        if cached:
+            self.cached_pages.add(page_path)
+            sections += ", cached"
+        else:
+            self.timings[page_path] = elapsed
+        click.echo(
+            f" -> {_display_path(output_path, self.out_dir or root_dir)} "
+            f"({elapsed:.2f} s{sections})"
+        )
+
+        return output_path
+
+    def _render_cached(
+        self, input_path: pathlib.Path, ctx_vars: Dict
+    ) -> Tuple[str, bool]:
+        """
+        Render a page, or take it from the build cache.
+
+        Returns:
+            The page, and whether it came from the cache.
+        """
+        # Pages that add to the search index or write change data have side
+        # effects, and are always rendered
+        if (
+            not self.build_cache
+            or self.search_index
+            or ctx_vars.get("show-changes-data") == "sidecar"
+        ):
+            return self.render(input_path, **ctx_vars), False
+        key = self._page_key(input_path, ctx_vars)
+        text = self.build_cache.get(key)
+        if text is not None:
+            return text, True
+        dependencies: Set[pathlib.Path] = set()
+        text = self.render(input_path, dependencies=dependencies, **ctx_vars)
+        self.build_cache.set(key, text, dependencies)
+        return text, False
+
+    def page_timings(self, root_dir: pathlib.Path) -> Dict[pathlib.Path, float]:
+        """
+        Return the render timings of the converted pages. Pages taken from the
+        build cache have their previous timings, if known.
+        """
+        timings = dict(self.timings)
+        for path in self.cached_pages:
+            name = path.relative_to(root_dir).as_posix()
+            if name in self.previous_timings:
+                timings[path] = self.previous_timings[name]
+        return timings
+
+    def _page_key(self, input_path: pathlib.Path, ctx_vars: Dict) -> str:
+        root_dir = ctx_vars["root_dir"]
+        page_vars = {
+            name: value
+            for name, value in ctx_vars.items()
+            if name not in ("root_dir", "store", "pages", "page_index")
+        }
+        options = {name: self.options.get(name) for name in CACHE_KEY_OPTIONS}
+        references = None
+        if self.references:
+            pattern, metadata = self.references
+            references = [pattern.pattern, {k: v[0] for k, v in metadata.items()}]
+        return digest(
+            input_path.relative_to(root_dir),
+            page_vars,
+            self._changes_key(input_path, ctx_vars),
+            self.site_digest,
+            options,
+            references,
+            dict(os.environ) if self.options["env"] else None,
+            code_digest(),
+        )
+
+    @staticmethod
+    def _changes_key(input_path: pathlib.Path, ctx_vars: Dict) -> Optional[List]:
+        """
+        Return what the changes shown with `show-changes-since` depend on: the
+        commit it resolves to, and the contents of the page. The page is only
+        blamed when it is rendered.
+        """
+        changes_since = ctx_vars.get("show-changes-since")
+        if not changes_since:
+            return None
+        repo = GitRepo(input_path.parent)
+        return [
+            repo.rev_list(changes_since),
+            repo.blob_id(input_path),
+        ]
+
+    def _write_output(
+        self,
+        page_path: pathlib.Path,
+        output_path: pathlib.Path,
+        text: str,
+        filename: Optional[str] = None,
+    ):
+        input_path = page_path.resolve()
+        if self.link_checker:
+            self.link_checker.add(input_path, text, filename)
+        if self.assets:
+            text = self.assets.collect(text, input_path)
+        self.output_pages[output_path] = page_path
+        with self._memory_stage("write"):
+            self.writer.write(output_path, text)
+
+    def render(
+        self,
+        input_path: pathlib.Path,
+        template_name: Optional[Union[str, pathlib.Path]] = None,
+        **ctx_vars,
+    ) -> str:
+        """
+        Render a Markdown file to HTML with its templates.
+
+        Args:
+            input_path: Path of the file to render.
+            template_name: Template to use instead of the one from the options.
+            ctx_vars: Dict of variables available to the template.
+
+        Returns:
+            The rendered HTML.
+
+        Raises:
+            jinja2.exceptions.TemplateError: If there was a template rendering issue.
+        """
         input_path = input_path.resolve()
         self.loader.set_root_file(input_path)
 
         ctx_vars["body"] = str(input_path)
         ctx_vars["encoding"] = self.encoding
-        ctx_vars["references"] = self.references
-        ctx_vars["store"] = dict()
-
-        if self.options["template"]:
-            template = self.get_template(self.options["template"].with_suffix(".html"))
+        # Only pages that link references need the reference index
+        if self.options["reference"] and not ctx_vars.get("no-refs"):
+            ctx_vars["references"] = self.references
+            self.context_usage["references"] += 1
+        else:
+            ctx_vars["references"] = None
+        ctx_vars["search_index"] = self.search_index
+        ctx_vars["image_sizes"] = self.image_sizes
+        ctx_vars["store"] = store = PageStore()
+        ctx_vars["memory"] = self.memory
+
+        template_name = template_name or self.options["template"]
+        if template_name:
+            template_name = pathlib.Path(template_name).with_suffix(".html")
+            template = self.get_template(template_name)
         elif self.options["no_template"]:
             template = self.get_template(input_path)
         else:
@@ -141,30 +555,124 @@ class Converter:
         else:
             ctx_vars["style"] = "_default.css"
 
-        if self.options["output"]:
-            output_path = self.options["output"]
-        else:
-            output_path = input_path.with_suffix(".html")
-
-        with output_path.open("w") as output_fh:
-            output_fh.write(template.render(**ctx_vars))
+        profiling = contextlib.nullcontext()
+        if self.profiler:
+            profiling = self.profiler.page(input_path)
+        try:
+            with profiling, self._memory_stage("render"):
+                if self.options.get("minify"):
+                    return minify_html(template.render(**ctx_vars))
+                return template.render(**ctx_vars)
+        finally:
+            self.renders += 1
+            self.context_usage.update(f"store.{key}" for key in store.used)
+
+    def report_broken_links(self) -> int:
+        """
+        Report the broken internal links found by the link checker.
 
-        click.echo(
-            f" -> {output_path.relative_to(root_dir)} "
-            f"({(time.time() - starttime):.2f} s)"
+        Returns:
+            The number of broken links.
+        """
+        broken = self.link_checker.check()
+        root_dir = self.options["root"]
+        for link, reason in broken:
+            path, _, href = link
+            line = self.link_checker.source_line(link)
+            location = f"{path.relative_to(root_dir)}:{line or '?'}"
+            click.echo(f"{location}: broken link '{href}': {reason}", err=True)
+        self.broken_links = len(broken)
+        return self.broken_links
+
+    def close(self):
+        """
+        Finish writing the output, e.g. to an archive.
+        """
+        if self.image_sizes:
+            self.image_sizes.save()
+        self.writer.close()
+        root_dir = self.options["root"]
+        if self.profiler:
+            self.profiler.stop()
+            self.profiler.write(self.options["profile_templates"])
+            click.echo(f"Hot template lines ({self.profiler.samples} samples):")
+            for line, count in self.profiler.hot_lines(PROFILE_TOP_LINES):
+                click.echo(f"{count:8} {count / self.profiler.samples:6.1%}  {line}")
+        if self.memory:
+            self._report_memory()
+        if self.options.get("context_usage") and self.renders:
+            click.echo(f"Context values used by {self.renders} renderings:")
+            for name, count in sorted(self.context_usage.items()):
+                click.echo(f"{count:8} {count / self.renders:6.1%}  {name}")
+        for output_path, e in getattr(self.writer, "errors", ()):
+            page_path = self.output_pages.get(output_path)
+            if page_path is None:
+                name = _display_path(output_path, self.out_dir or root_dir)
+            else:
+                name = _display_path(page_path, root_dir)
+            click.echo(f"{name}: {e}", err=True)
+            self.write_errors += 1
+        archive_path = self.options.get("output_archive")
+        if archive_path and self.write_errors:
+            click.echo(f"{archive_path}: removed, since it is incomplete", err=True)
+
+    def _report_memory(self):
+        summary = self.memory.write(self.options["memory_report"])
+        click.echo(f"Peak traced memory: {_megabytes(summary['peak'])}")
+        pages = sorted(
+            summary["pages"].items(), key=lambda item: (-item[1]["peak"], item[0])
         )
-
-        return output_path
+        click.echo("Pages using the most memory:")
+        for name, page in pages[:MEMORY_TOP_COUNT]:
+            click.echo(f"{_megabytes(page['peak']):>10}  {name}")
+        stages = sorted(summary["stages"].items(), key=lambda item: -item[1]["peak"])
+        click.echo("Stages using the most memory:")
+        for name, stage in stages[:MEMORY_TOP_COUNT]:
+            page = f" ({stage['page']})" if stage["page"] else ""
+            click.echo(f"{_megabytes(stage['peak']):>10}  {name}{page}")
+
+    def _add_git_metadata(self, pages: Dict[pathlib.Path, jinja2.Template]):
+        """
+        Add `last_modified`, `last_commit` and `authors` to the metadata of the
+        pages from a single pass over the git history.
+        """
+        if not pages:
+            return
+        repo = GitRepo.from_path(next(iter(pages)).resolve())
+        history = repo.file_history() if repo is not None else {}
+        for path, template in pages.items():
+            commit = None
+            if repo is not None:
+                try:
+                    filename = path.resolve().relative_to(repo.repo_path).as_posix()
+                    commit = history.get(filename)
+                except ValueError:
+                    pass
+            # Always set the keys on the page itself, so that pages do not
+            # inherit the history of their parent index.md page
+            template.metadata.maps[0].update(
+                last_modified=commit and commit["date"],
+                last_commit=commit,
+                authors=commit["authors"] if commit else [],
+            )
 
     def _build_references(
         self, path: pathlib.Path, root_dir: pathlib.Path, levels: Iterable[int]
     ) -> References:
-        store: Dict = dict()
+        store = PageStore()
         ctx: Dict = dict(store=store)
         markdown_to_html(path.read_text(encoding=self.encoding), ctx)
         regexes = []
         metadata = {}
         index = 1
+        files: Dict[str, str] = {}
+        split = self.options.get("split_sections")
+        split = split or self.loader.read_metadata(path).get("split-sections")
+        if split:
+            toc = store["toc_list"]
+            split_at = split_level(toc, None if split is True else int(split))
+            if split_at is not None:
+                files = section_files(toc, split_at, path)
         for level, anchor, name in store["toc_list"]:
             if level not in levels:
                 continue
@@ -180,8 +688,9 @@ class Converter:
                 aliases = name.split("/")
             else:
                 aliases = [name]
+            target = path.with_name(files.get(anchor, path.with_suffix(".html").name))
             data = [
-                f"/{path.relative_to(root_dir).with_suffix('.html')}#{anchor}",
+                f"/{target.relative_to(root_dir)}#{anchor}",
                 path,
                 anchor,
             ]
@@ -201,3 +710,16 @@ class Converter:
         regexes.sort(key=lambda regex: len(regex), reverse=True)
         pattern = re.compile("|".join(regexes))
         return (pattern, metadata)
+
+
+def _megabytes(size: int) -> str:
+    return f"{size / (1024 * 1024):.1f} MB"
+
+
+def _display_path(path: pathlib.Path, root_dir: pathlib.Path) -> str:
+    # Paths outside the root, e.g. with --out-dir on another tree, are shown
+    # in full
+    try:
+        return str(path.relative_to(root_dir))
+    except ValueError:
+        return str(path)
@@ -1,13 +1,17 @@
 import datetime
+import json
 import pathlib
 import subprocess
 
-from typing import Any, Dict, Iterator, Optional
+from typing import Any, Dict, Iterator, Optional, Tuple
 
 
 Commit = Dict[str, Any]
 Blame = Dict[int, Commit]
 CommitMap = Dict[str, Optional[Commit]]
+FileHistory = Dict[str, Commit]
+
+_history_cache: Dict[Tuple[pathlib.Path, str], FileHistory] = {}
 
 
 class GitRepo:
@@ -21,6 +25,23 @@ class GitRepo:
         self.git_path = git_path or self.repo_path.joinpath(".git")
         self.cmd_path = cmd_path
 
+    @classmethod
+    def from_path(
+        cls, path: pathlib.Path, cmd_path: str = "git"
+    ) -> Optional["GitRepo"]:
+        """
+        Return the repository containing `path`, or None if it is not in one.
+        """
+        result = subprocess.run(
+            [cmd_path, "rev-parse", "--show-toplevel", "--absolute-git-dir"],
+            capture_output=True,
+            cwd=path if path.is_dir() else path.parent,
+        )
+        if result.returncode != 0:
+            return None
+        repo_path, git_path = result.stdout.decode().splitlines()
+        return cls(pathlib.Path(repo_path), pathlib.Path(git_path), cmd_path)
+
     def git(self, *args) -> subprocess.CompletedProcess:
         cmd_args = [
             self.cmd_path,
@@ -74,6 +95,75 @@ class GitRepo:
             commit["date"] = self.fromtimestamp(commit["author-time"])
         return line_commits
 
+    def blob_id(self, file_path: pathlib.Path) -> str:
+        """
+        Return the id git gives the current contents of the file at `file_path`.
+        """
+        if not file_path.is_absolute():
+            file_path = self.repo_path.joinpath(file_path)
+        return self.git_output("hash-object", file_path)
+
+    def file_history(self) -> FileHistory:
+        """
+        Return the last commit and the authors for every file in the repository,
+        keyed by the path relative to the repository root.
+
+        The history is read with a single `git log` call and cached by HEAD, both
+        in memory and in the git directory.
+        """
+        head = self.rev_parse("HEAD")
+        key = (self.git_path, head)
+        if key in _history_cache:
+            return _history_cache[key]
+        cache_path = self.git_path.joinpath("mullendore-history.json")
+        try:
+            cached = json.loads(cache_path.read_text())
+            if cached["head"] == head:
+                _history_cache[key] = cached["files"]
+                return cached["files"]
+        except (OSError, ValueError, KeyError):
+            pass
+        history = self._parse_log(
+            self.git_output(
+                "-c",
+                "core.quotePath=false",
+                "log",
+                "--name-only",
+                "--format=%x00%H%x1f%an%x1f%at%x1f%s",
+            )
+        )
+        try:
+            cache_path.write_text(json.dumps(dict(head=head, files=history)))
+        except OSError:
+            pass
+        _history_cache[key] = history
+        return history
+
+    def _parse_log(self, log: str) -> FileHistory:
+        history: FileHistory = {}
+        for entry in log.split("\0"):
+            if not entry:
+                continue
+            header, *filenames = entry.splitlines()
+            commit_hash, author, timestamp, summary = header.split("\x1f", 3)
+            commit = dict(
+                hash=commit_hash,
+                author=author,
+                date=self.fromtimestamp(timestamp),
+                summary=summary,
+            )
+            for filename in filenames:
+                if not filename:
+                    continue
+                if filename in history:
+                    authors = history[filename]["authors"]
+                    if author not in authors:
+                        authors.append(author)
+                else:
+                    # Log is newest first, so the first commit seen is the last one
+                    history[filename] = dict(commit, authors=[author])
+        return history
+
     def _parse_blame_line(
         self, lines: Iterator, commits: CommitMap, changes_since: str = None
     ):
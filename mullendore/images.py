@@ -0,0 +1,182 @@
+import concurrent.futures
+import json
+import pathlib
+import re
+import struct
+import threading
+
+from typing import BinaryIO, Dict, Iterable, List, Optional, Tuple
+
+
+Size = Tuple[int, int]
+
+_md_image_pattern = re.compile(r"!\[[^\]]*\]\(\s*<?([^)\s>]+)")
+_html_image_pattern = re.compile(r"<img [^>]*?src=\"(.*?)\"")
+
+
+def image_size(path: pathlib.Path) -> Optional[Size]:
+    """
+    Return the width and height of a PNG, JPEG, GIF or WebP image, reading only
+    its header. Returns None for other files.
+    """
+    try:
+        with path.open("rb") as fh:
+            head = fh.read(32)
+            if head.startswith(b"\x89PNG\r\n\x1a\n") and head[12:16] == b"IHDR":
+                return struct.unpack(">II", head[16:24])
+            if head[:6] in (b"GIF87a", b"GIF89a"):
+                return struct.unpack("<HH", head[6:10])
+            if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+                return _webp_size(head)
+            if head[:2] == b"\xff\xd8":
+                fh.seek(2)
+                return _jpeg_size(fh)
+    except (OSError, struct.error):
+        pass
+    return None
+
+
+def _webp_size(head: bytes) -> Optional[Size]:
+    # All three formats keep the size within the first 30 bytes
+    if len(head) < 30:
+        return None
+    chunk = head[12:16]
+    if chunk == b"VP8X":
+        width = int.from_bytes(head[24:27], "little") + 1
+        height = int.from_bytes(head[27:30], "little") + 1
+        return width, height
+    if chunk == b"VP8 " and head[23:26] == b"\x9d\x01\x2a":
+        width, height = struct.unpack("<HH", head[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L" and head[20] == 0x2F:
+        bits = int.from_bytes(head[21:25], "little")
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    return None
+
+
+_jpeg_sof_markers = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7}
+_jpeg_sof_markers |= {0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _jpeg_size(fh: BinaryIO) -> Optional[Size]:
+    while True:
+        byte = fh.read(1)
+        while byte == b"\xff":
+            byte = fh.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            continue
+        (length,) = struct.unpack(">H", fh.read(2))
+        if marker in _jpeg_sof_markers:
+            height, width = struct.unpack(">xHH", fh.read(5))
+            return width, height
+        fh.seek(length - 2, 1)
+
+
+def image_sources(text: str) -> List[str]:
+    """
+    Return the image sources referenced from a Markdown or HTML text.
+    """
+    return _md_image_pattern.findall(text) + _html_image_pattern.findall(text)
+
+
+class ImageSizeCache:
+    """
+    Cache of image sizes keyed by path and modification time, optionally
+    persisted as JSON in `cache_path`. Sizes can be prefetched in background
+    threads with `prefetch` before they are needed.
+    """
+
+    def __init__(self, cache_path: Optional[pathlib.Path] = None, max_workers=8):
+        self.cache_path = cache_path
+        self.sizes: Dict[str, list] = {}
+        if cache_path:
+            try:
+                self.sizes = json.loads(cache_path.read_text())
+            except (OSError, ValueError):
+                pass
+        self.pending: Dict[pathlib.Path, concurrent.futures.Future] = {}
+        self.scans: List[concurrent.futures.Future] = []
+        self.lock = threading.Lock()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers)
+
+    def get(self, path: pathlib.Path) -> Optional[Size]:
+        """
+        Return the size of the image at `path`, or None if it is unknown.
+        """
+        with self.lock:
+            future = self.pending.get(path)
+        if future:
+            return future.result()
+        return self._lookup(path)
+
+    def _lookup(self, path: pathlib.Path) -> Optional[Size]:
+        try:
+            mtime = path.stat().st_mtime
+        except OSError:
+            return None
+        cached = self.sizes.get(str(path))
+        if cached and cached[0] == mtime:
+            return tuple(cached[1]) if cached[1] else None
+        size = image_size(path)
+        self.sizes[str(path)] = [mtime, size]
+        return size
+
+    def prefetch(self, paths: Iterable[pathlib.Path]):
+        """
+        Read the sizes of the images at `paths` in the background.
+        """
+        with self.lock:
+            for path in paths:
+                if path not in self.pending:
+                    self.pending[path] = self.executor.submit(self._lookup, path)
+
+    def prefetch_sources(
+        self, page_paths: Iterable[pathlib.Path], root_dir: pathlib.Path
+    ):
+        """
+        Read the pages at `page_paths` in the background and prefetch the sizes
+        of the local images they reference.
+        """
+
+        def scan(page_path: pathlib.Path):
+            try:
+                text = page_path.read_text()
+            except (OSError, ValueError):
+                return
+            paths = (
+                resolve_src(src, page_path, root_dir) for src in image_sources(text)
+            )
+            self.prefetch(path for path in paths if path)
+
+        for page_path in page_paths:
+            self.scans.append(self.executor.submit(scan, page_path))
+
+    def save(self):
+        """
+        Wait for pending prefetches and write the cache file, if any.
+        """
+        concurrent.futures.wait(self.scans)
+        with self.lock:
+            pending = list(self.pending.values())
+        concurrent.futures.wait(pending)
+        if self.cache_path:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            self.cache_path.write_text(json.dumps(self.sizes))
+
+
+def resolve_src(
+    src: str, page_path: pathlib.Path, root_dir: pathlib.Path
+) -> Optional[pathlib.Path]:
+    """
+    Return the local path of an image `src` on the page at `page_path`, or None
+    if it is not a local path.
+    """
+    if "://" in src or src.startswith(("data:", "//")):
+        return None
+    src = src.split("#", 1)[0].split("?", 1)[0]
+    if src.startswith("/"):
+        return root_dir.joinpath(src.lstrip("/")).resolve()
+    return page_path.parent.joinpath(src).resolve()
@@ -0,0 +1,106 @@
+import bisect
+import html
+import pathlib
+import posixpath
+import re
+import urllib.parse
+
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+
+_html_id_pattern = re.compile(r'\bid="(.*?)"')
+_html_href_pattern = re.compile(r'\bhref="(.*?)"')
+_external_prefixes = ("mailto:", "tel:", "javascript:", "data:", "//")
+
+Link = Tuple[pathlib.Path, int, str]
+
+
+class LinkChecker:
+    """
+    Collects the internal links and anchors of the rendered pages, and checks
+    that every link points to an existing page, file and anchor.
+    """
+
+    def __init__(self, root_dir: pathlib.Path):
+        self.root_dir = root_dir
+        self.pages: Set[str] = set()
+        self.anchors: Dict[str, Set[str]] = {}
+        self.links: List[Tuple[Link, str, Optional[str]]] = []
+
+    def url(self, path: pathlib.Path, filename: Optional[str] = None) -> str:
+        target = path.with_name(filename) if filename else path.with_suffix(".html")
+        return f"/{target.relative_to(self.root_dir).as_posix()}"
+
+    def add_pages(self, paths: Iterable[pathlib.Path]):
+        """
+        Register the pages of the build, including pages not rendered by it.
+        """
+        self.pages.update(self.url(path) for path in paths)
+
+    def add(self, path: pathlib.Path, text: str, filename: Optional[str] = None):
+        """
+        Collect the anchors and links of the rendered HTML `text` of the page at
+        `path`, or of its output file `filename` if given.
+        """
+        page_url = self.url(path, filename)
+        self.anchors[page_url] = set(_html_id_pattern.findall(text))
+        newlines = [match.start() for match in re.finditer("\n", text)]
+        for match in _html_href_pattern.finditer(text):
+            href = html.unescape(match.group(1))
+            if not href or "://" in href or href.startswith(_external_prefixes):
+                continue
+            target, _, anchor = href.partition("#")
+            target = target.split("?", 1)[0]
+            if not target:
+                target = page_url
+            elif not target.startswith("/"):
+                target = posixpath.normpath(
+                    posixpath.join(posixpath.dirname(page_url), target)
+                )
+            line = bisect.bisect(newlines, match.start()) + 1
+            self.links.append(((path, line, href), target, anchor or None))
+
+    def check(self) -> List[Tuple[Link, str]]:
+        """
+        Return the broken links with the reason they are broken.
+        """
+        broken = []
+        files: Dict[str, bool] = {}
+        for link, target, anchor in self.links:
+            if target in self.pages or target in self.anchors:
+                anchors = self.anchors.get(target)
+                if anchor and anchors is not None and anchor not in anchors:
+                    broken.append((link, f"no anchor '{anchor}' in {target}"))
+                continue
+            if target not in files:
+                path = self.root_dir.joinpath(target.lstrip("/"))
+                files[target] = path.exists()
+            if not files[target]:
+                broken.append((link, f"no such page or file {target}"))
+        return broken
+
+    def source_line(self, link: Link) -> Optional[int]:
+        """
+        Return the line of the source file where the link appears, or None if
+        it cannot be found. The link is looked up as a Markdown link target,
+        and then as the full href, as written, percent-decoded and escaped
+        for HTML.
+        """
+        path, _, href = link
+        try:
+            source = path.read_text()
+        except OSError:
+            return None
+        href = html.unescape(href)
+        targets = list(
+            dict.fromkeys(
+                (href, urllib.parse.unquote(href), html.escape(href, quote=False))
+            )
+        )
+        needles = [f"]({target}" for target in targets]
+        needles += [f"]: {target}" for target in targets]
+        for needle in needles + targets:
+            pos = source.find(needle)
+            if needle and pos >= 0:
+                return source.count("\n", 0, pos) + 1
+        return None
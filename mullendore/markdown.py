@@ -1,31 +1,89 @@
+import atexit
+import collections
+import concurrent.futures
+import contextlib
 import html
 import jinja2
+import json
 import markdown2
+import multiprocessing
+import os
 import pathlib
 import re
 
 from mullendore.git import GitRepo, CommitMap
+from mullendore.images import resolve_src
+from mullendore.types import add_dependency
 
-from typing import Callable, Dict, List
+from typing import Callable, Dict, List, Optional, Union
 
+Trigger = Optional[Union[str, Callable]]
 
-preprocessors = []
-postprocessors = []
+
+preprocessors: List[Callable] = []
+postprocessors: List[Callable] = []
+processor_stats: Dict[str, collections.Counter] = collections.defaultdict(
+    collections.Counter
+)
+
+DEFAULT_PRIORITY = 100
 
 
-def markdown_preprocessor(func: Callable) -> Callable:
+def markdown_preprocessor(
+    func: Optional[Callable] = None,
+    *,
+    priority: int = DEFAULT_PRIORITY,
+    when: Trigger = None,
+    enabled: bool = True,
+) -> Callable:
     """
     Decorator to mark a function as a markdown preprocessor.
+
+    Args:
+        priority: Processors run in order of ascending priority.
+        when: Substring that must be in the text, or a function called with
+            the context and the text, for the processor to run.
+        enabled: Whether the processor runs unless enabled or disabled for
+            a page in the `processors` metadata.
     """
-    preprocessors.append(func)
-    return func
 
+    def decorator(func: Callable) -> Callable:
+        return _register(preprocessors, func, priority, when, enabled)
+
+    return decorator(func) if func else decorator
 
-def markdown_postprocessor(func: Callable) -> Callable:
+
+def markdown_postprocessor(
+    func: Optional[Callable] = None,
+    *,
+    priority: int = DEFAULT_PRIORITY,
+    when: Trigger = None,
+    enabled: bool = True,
+) -> Callable:
     """
-    Decorator to mark a function as a markdown postprocessor.
+    Decorator to mark a function as a markdown postprocessor. Takes the same
+    arguments as `markdown_preprocessor`.
     """
-    postprocessors.append(func)
+
+    def decorator(func: Callable) -> Callable:
+        return _register(postprocessors, func, priority, when, enabled)
+
+    return decorator(func) if func else decorator
+
+
+def _register(
+    processors: List[Callable],
+    func: Callable,
+    priority: int,
+    when: Trigger,
+    enabled: bool,
+) -> Callable:
+    setattr(func, "priority", priority)
+    setattr(func, "when", when)
+    setattr(func, "enabled", enabled)
+    processors.append(func)
+    # Stable sort keeps the registration order within a priority
+    processors.sort(key=lambda func: func.priority)
     return func
 
 
@@ -37,7 +95,9 @@ def pass_context(func: Callable) -> Callable:
     return func
 
 
-@markdown_preprocessor
+@markdown_preprocessor(
+    priority=0, when=lambda ctx, text: ctx.get("show-changes-since")
+)
 @pass_context
 def show_changes_since(ctx: jinja2.runtime.Context, text: str) -> str:
     """
@@ -49,6 +109,7 @@ def show_changes_since(ctx: jinja2.runtime.Context, text: str) -> str:
     changes_repo = ctx.get("show-changes-repo")
     if not changes_since:
         return text
+    lazy = ctx.get("show-changes-data") in ("inline", "sidecar")
     file_path = pathlib.Path(ctx.get("body")).resolve()
     repo = GitRepo(file_path.parent)
     commits = repo.blame_file(file_path, changes_since=changes_since)
@@ -60,7 +121,30 @@ def show_changes_since(ctx: jinja2.runtime.Context, text: str) -> str:
 
     def add_section(header, body, changes, out):
         if header:
-            if changes:
+            if changes and lazy:
+                # Only the badge goes in the header, the changes are collected
+                # by `change_data` once the header has an anchor
+                header += (
+                    '<div class="tooltip change">'
+                    f'<div class="change-icon"><span>{len(changes)}</span></div>'
+                    "</div>"
+                )
+                data = _json_script_data(
+                    [
+                        dict(
+                            author=commit["author"],
+                            date=commit["date"],
+                            summary=commit["summary"],
+                            url=changes_repo.format(commit=commit["hash"]),
+                        )
+                        for commit in changes.values()
+                    ]
+                )
+                header += (
+                    '\n\n<script type="application/json" class="change-data">'
+                    f"{data}</script>\n"
+                )
+            elif changes:
                 change_list = "".join(
                     (
                         '<div class="change-item"><span class="change-author">'
@@ -101,13 +185,123 @@ def show_changes_since(ctx: jinja2.runtime.Context, text: str) -> str:
     return out
 
 
+_html_change_data_pattern = re.compile(
+    '<h[1-6] id="([^"]*)"|<script type="application/json" class="change-data">'
+    "(.*?)</script>\n?"
+)
+
+_change_script = """<script>
+(function () {
+  var data = null;
+  function load() {
+    if (!data) {
+      var element = document.getElementById("change-data");
+      data = element.dataset.src
+        ? fetch(element.dataset.src).then(function (response) {
+            return response.json();
+          })
+        : Promise.resolve(JSON.parse(element.textContent));
+    }
+    return data;
+  }
+  function span(className, text) {
+    var element = document.createElement("span");
+    element.className = className;
+    element.textContent = text;
+    return element;
+  }
+  document.addEventListener("mouseover", function (event) {
+    var badge = event.target.closest && event.target.closest(".change");
+    if (!badge || badge.querySelector(".change-list")) return;
+    var header = badge.closest("h1, h2, h3, h4, h5, h6");
+    var link = badge.previousElementSibling;
+    var anchor = header ? header.id : link && link.hash.slice(1);
+    var list = document.createElement("div");
+    list.className = "change-list";
+    badge.appendChild(list);
+    load().then(function (changes) {
+      (changes[anchor] || []).forEach(function (change) {
+        var item = document.createElement("div");
+        var summary = span("change-summary", "");
+        var a = document.createElement("a");
+        item.className = "change-item";
+        a.href = change.url;
+        a.textContent = change.summary;
+        summary.appendChild(a);
+        item.appendChild(span("change-author", change.author));
+        item.appendChild(document.createTextNode(" "));
+        item.appendChild(span("change-date", change.date + ":"));
+        item.appendChild(document.createElement("br"));
+        item.appendChild(summary);
+        list.appendChild(item);
+      });
+    });
+  });
+})();
+</script>
+"""
+
+
+def _json_script_data(data) -> str:
+    # Keep the JSON from closing the script element it is in
+    return json.dumps(data).replace("<", "\\u003c")
+
+
+@markdown_postprocessor(priority=50, when='class="change-data"')
+@pass_context
+def change_data(ctx, text):
+    """
+    Collect the changes of each header, written by `show_changes_since`, keyed
+    by header anchor. They are added to the page by `change_script`, before
+    which other postprocessors must not see them.
+    """
+    changes = ctx["store"].setdefault("change_data", {})
+    anchor = None
+
+    def repl(match):
+        nonlocal anchor
+        if match.group(1) is not None:
+            anchor = match.group(1)
+            return match.group()
+        if anchor is not None:
+            changes[anchor] = json.loads(match.group(2))
+        return ""
+
+    return _html_change_data_pattern.sub(repl, text)
+
+
+@markdown_postprocessor(
+    priority=200, when=lambda ctx, text: ctx["store"].peek("change_data")
+)
+@pass_context
+def change_script(ctx, text):
+    """
+    Add the changes collected by `change_data` as a single JSON object, and a
+    script that fills in the change lists when a change badge is hovered.
+    With `show-changes-data: sidecar`, the changes are instead added to the
+    `change_data` of the context, to be written next to the page and fetched
+    on first use.
+    """
+    changes = ctx["store"].pop("change_data")
+    sidecar = ctx.get("change_data")
+    if ctx.get("show-changes-data") == "sidecar" and sidecar is not None:
+        sidecar.update(changes)
+        src = f"{pathlib.Path(ctx['body']).stem}.changes.json"
+        element = f'<script type="application/json" id="change-data" data-src="{src}">'
+        data = ""
+    else:
+        element = '<script type="application/json" id="change-data">'
+        data = _json_script_data(changes)
+    return f"{text}{element}{data}</script>\n{_change_script}"
+
+
 _md_plustable_pattern = re.compile(
     r"^\+\+\+(.*?)\n(.*?)\n\+\+\+\n", re.DOTALL | re.MULTILINE
 )
 _md_plustable_cell_pattern = re.compile("  +")
 
 
-@markdown_preprocessor
+@markdown_preprocessor(when="+++")
 def plustables(text):
     """
     Support for thist type of table syntax:
@@ -156,12 +350,16 @@ def plustables(text):
     return _md_plustable_pattern.sub(process_table, text)
 
 
-@markdown_postprocessor
+@markdown_postprocessor(when="&#82")
 def swedish_quotes(text):
     return text.replace("&#8216;", "&#8217;").replace("&#8220;", "&#8221;")
 
 
-@markdown_postprocessor
+@markdown_postprocessor(
+    when=lambda ctx, text: (
+        ctx.get("references") and ctx.get("body") and not ctx.get("no-refs")
+    )
+)
 @pass_context
 def link_references(ctx, text):
     if ctx.get("no-refs"):
@@ -236,8 +434,12 @@ _html_img_alt_pattern = re.compile('alt="(.*?)"')
 _html_img_hashtag_pattern = re.compile("#\\w+")
 
 
-@markdown_postprocessor
-def link_html_images(text):
+@markdown_postprocessor(when="<img ")
+@pass_context
+def link_html_images(ctx, text):
+    image_sizes = ctx.get("image_sizes")
+    page_path = ctx.get("body")
+
     def repl(match):
         src = _html_img_src_pattern.search(match.group()).group(1)
         alt = _html_img_alt_pattern.search(match.group()).group(1)
@@ -247,9 +449,20 @@ def link_html_images(text):
             classes.append(hashtag.strip("#"))
         if not src.endswith(".png") and "noshadow" not in classes:
             classes.append("shadow")
+        attrs = ""
+        if image_sizes is not None:
+            path = page_path and resolve_src(
+                html.unescape(src), pathlib.Path(page_path), ctx.get("root_dir")
+            )
+            size = image_sizes.get(path) if path else None
+            if path:
+                add_dependency(ctx, path)
+            if size:
+                attrs += f' width="{size[0]}" height="{size[1]}"'
+            attrs += ' loading="lazy" decoding="async"'
         return (
             f'<a href="{src}">'
-            f'<img class="{" ".join(classes)}" src="{src}" alt="{alt}" />'
+            f'<img class="{" ".join(classes)}" src="{src}" alt="{alt}"{attrs} />'
             "</a>"
         )
 
@@ -259,7 +472,7 @@ def link_html_images(text):
 _html_header_pattern = re.compile("<h([0-9]).*?>")
 
 
-@markdown_postprocessor
+@markdown_postprocessor(when="<h")
 def header_sections(text):
     out = ""
     last_pos = 0
@@ -312,23 +525,71 @@ class Markdown(markdown2.Markdown):
 markdowner = Markdown()
 
 
+# Documents at least this long are converted in sections
+SPLIT_THRESHOLD = 1000000
+
+
 def markdown_to_html(text: str, ctx: Dict, skip_toc: bool = False) -> str:
     """
     Convert Markdown text to HTML.
     """
-    markdowner._toc = None
+    # Pages split into a file per section are converted once, and each
+    # rendering of the page uses its part of the HTML
+    split_page = None
+    if skip_toc is False and ctx.get("body"):
+        split_page = ctx.get("split_page")
     markdowner.ctx = ctx
-    text = _preprocess(ctx, text)
-    html = markdowner.convert(text)
+    if split_page is not None and split_page.parts is not None:
+        html, toc = split_page.parts[split_page.current], split_page.toc
+    else:
+        html, toc = _convert(ctx, text)
+        if split_page is not None:
+            split_page.split(html, toc)
+            html = split_page.parts[split_page.current]
     html = _postprocess(ctx, html)
     markdowner.ctx = None
-    toc = markdowner._toc
+    files = split_page.files if split_page is not None else None
     if toc and skip_toc is False:
         ctx["store"]["toc_list"] = toc
-        ctx["store"]["toc"] = _calculate_toc_html(toc, ol_levels={1, 2})
+        # Most pages never show their TOC
+        ctx["store"].set_lazy(
+            "toc", lambda: _calculate_toc_html(toc, ol_levels={1, 2}, files=files)
+        )
+    search_index = ctx.get("search_index")
+    if search_index is not None and skip_toc is False and ctx.get("body"):
+        search_index.add(
+            pathlib.Path(ctx["body"]),
+            html,
+            toc,
+            ctx.get("title"),
+            filename=split_page.filename if split_page is not None else None,
+        )
     return html
 
 
+def _convert(ctx: Dict, text: str):
+    markdowner._toc = None
+    text = _preprocess(ctx, text)
+    sections = None
+    if len(text) >= (ctx.get("split-threshold") or SPLIT_THRESHOLD):
+        sections = _split_sections(text)
+    with _memory_stage(ctx, "markdown2"):
+        if sections:
+            return _convert_sections(sections)
+        return markdowner.convert(text), markdowner._toc
+
+
+def header_name(name: str) -> str:
+    """
+    Return the name of a header from the TOC, without tags, reference aliases
+    and options.
+    """
+    for sep in "</{":
+        if sep in name:
+            name, _ = name.split(sep, 1)
+    return name.strip()
+
+
 simple_markdowner = Markdown(extras=["smarty-pants"])
 
 
@@ -344,25 +605,173 @@ def simple_markdown_to_html(text: str) -> str:
     return html
 
 
+_md_header_pattern = re.compile(r"#{1,6}")
+_md_fence_pattern = re.compile(r" {0,3}(`{3,}|~{3,})")
+_md_html_block_pattern = re.compile(
+    r"<(div|table|pre|blockquote|ul|ol|dl|form|script|style|details)\b"
+)
+_md_link_definition_pattern = re.compile(
+    r"^ {0,3}\[[^\]\n]+\]:[ \t]*\S.*\n?", re.MULTILINE
+)
+
+
+def _split_sections(text: str) -> Optional[List[str]]:
+    """
+    Split Markdown text before its top-level headers, outside of code blocks
+    and HTML blocks. The top level is the highest level with at least two
+    headers up to it. Returns None if the text cannot be split.
+    """
+    lines = text.splitlines(keepends=True)
+    headers = []
+    fence = None
+    html_end = None
+    for i, line in enumerate(lines):
+        if fence:
+            if fence.match(line):
+                fence = None
+        elif html_end:
+            if line.startswith(html_end):
+                html_end = None
+        elif _md_fence_pattern.match(line):
+            # The closing fence is at least as long as the opening one
+            run = _md_fence_pattern.match(line).group(1)
+            fence = re.compile(rf" {{0,3}}{run[0]}{{{len(run)},}}[ \t]*$")
+        elif line.startswith("<"):
+            match = _md_html_block_pattern.match(line)
+            if match and f"</{match.group(1)}>" not in line:
+                html_end = f"</{match.group(1)}>"
+        elif line.startswith("#"):
+            headers.append((i, _md_header_pattern.match(line).end()))
+    levels = sorted(level for _, level in headers)
+    if len(levels) < 2:
+        return None
+    top_level = levels[1]
+    starts = [i for i, level in headers if level <= top_level and i > 0]
+    if not starts:
+        return None
+    definitions = "".join(
+        "\n" + match.group().rstrip("\n") + "\n"
+        for match in _md_link_definition_pattern.finditer(text)
+    )
+    sections = []
+    for start, end in zip([0] + starts, starts + [len(lines)]):
+        sections.append("".join(lines[start:end]) + definitions)
+    return sections
+
+
+class SectionMarkdown(Markdown):
+    """
+    Markdown converter for document sections, that leaves the numbering of
+    duplicate header ids to `_convert_sections`.
+    """
+
+    def header_id_from_text(self, text, prefix, n):
+        self._count_from_header_id.clear()
+        header_id = Markdown.header_id_from_text(self, text, prefix, n)
+        self.header_bases.extend(self._count_from_header_id)
+        return header_id
+
+    def convert(self, text):
+        self.header_bases = []
+        return Markdown.convert(self, text)
+
+
+section_markdowner = SectionMarkdown()
+_section_executor = None
+
+
+def _convert_section(text: str):
+    html = section_markdowner.convert(text)
+    toc = section_markdowner._toc or []
+    return str(html), [
+        (level, header_id, name, base)
+        for (level, header_id, name), base in zip(toc, section_markdowner.header_bases)
+    ]
+
+
+def _convert_sections(sections: List[str]):
+    """
+    Convert the sections of a document, in parallel processes if possible,
+    and join them as if the document was converted as a whole.
+    """
+    global _section_executor
+    results = None
+    if (os.cpu_count() or 1) > 1:
+        try:
+            if _section_executor is None:
+                # Forking while other threads run, like the output writer,
+                # can deadlock the workers
+                _section_executor = concurrent.futures.ProcessPoolExecutor(
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+                atexit.register(_section_executor.shutdown)
+            results = list(_section_executor.map(_convert_section, sections))
+        except (OSError, concurrent.futures.process.BrokenProcessPool):
+            _section_executor = None
+    if results is None:
+        results = [_convert_section(section) for section in sections]
+    html = []
+    toc = []
+    counts: Dict[str, int] = collections.Counter()
+    for section_html, section_toc in results:
+        pos = 0
+        for level, local_id, name, base in section_toc:
+            # Number duplicate header ids like markdown2 does within a document
+            counts[base] += 1
+            header_id = base
+            if not base or counts[base] > 1:
+                header_id = f"{base}-{counts[base]}"
+            tag = f'<h{level} id="{local_id}"'
+            i = section_html.find(tag, pos)
+            if header_id != local_id and i >= 0:
+                section_html = (
+                    f"{section_html[:i]}<h{level} id=\"{header_id}\""
+                    f"{section_html[i + len(tag):]}"
+                )
+            pos = max(i + 1, pos)
+            toc.append((level, header_id, name))
+        html.append(section_html)
+    return "\n".join(html), toc or None
+
+
 def _preprocess(ctx, text):
-    for func in preprocessors:
-        if hasattr(func, "pass_context"):
-            text = func(ctx, text)
-        else:
-            text = func(text)
-    return text
+    return _run_processors(preprocessors, ctx, text)
 
 
 def _postprocess(ctx, text):
-    for func in postprocessors:
-        if hasattr(func, "pass_context"):
-            text = func(ctx, text)
-        else:
-            text = func(text)
+    return _run_processors(postprocessors, ctx, text)
+
+
+def _run_processors(processors, ctx, text):
+    overrides = ctx.get("processors") or {}
+    for func in processors:
+        stats = processor_stats[func.__name__]
+        if not overrides.get(func.__name__, func.enabled):
+            stats["disabled"] += 1
+            continue
+        if func.when is not None:
+            if isinstance(func.when, str):
+                applies = func.when in text
+            else:
+                applies = func.when(ctx, text)
+            if not applies:
+                stats["skipped"] += 1
+                continue
+        stats["ran"] += 1
+        with _memory_stage(ctx, func.__name__):
+            if hasattr(func, "pass_context"):
+                text = func(ctx, text)
+            else:
+                text = func(text)
     return text
 
 
-def _calculate_toc_html(toc, ol_levels=None):
+def _memory_stage(ctx, name):
+    memory = ctx.get("memory")
+    return memory.stage(name) if memory else contextlib.nullcontext()
+
+
+def _calculate_toc_html(toc, ol_levels=None, files=None):
     if toc is None:
         return None
 
@@ -406,7 +815,8 @@ def _calculate_toc_html(toc, ol_levels=None):
         if "{" in name:
             name, _ = name.split("{", 1)
         # Open new LI element with link at this level
-        lines.append(f'<li>\n<a href="#{anchor}">{name.strip()}</a>{tag}')
+        href = f"{files.get(anchor, '')}#{anchor}" if files else f"#{anchor}"
+        lines.append(f'<li>\n<a href="{href}">{name.strip()}</a>{tag}')
         li_stack.append(level)
         prev_level = level
 
@@ -0,0 +1,190 @@
+import contextlib
+import json
+import pathlib
+import tracemalloc
+
+from typing import Dict, List, Optional
+
+
+# Number of frames kept for each allocation
+TRACEBACK_FRAMES = 8
+# Number of allocation sites kept for each page and stage
+SCOPE_SITES = 5
+# Number of pages whose allocation sites are kept
+SITE_PAGES = 10
+
+# Python 3.8 cannot reset the peak, so only new overall peaks can be seen
+_reset_peak = getattr(tracemalloc, "reset_peak", None)
+
+# Leave out the memory used by tracing and by the tracker itself
+_filters = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, __file__),
+)
+
+
+class _Scope:
+    def __init__(self, name: str, start: int):
+        self.name = name
+        self.start = start
+        self.peak = start
+        self.retained = 0
+        self.sites: List[Dict] = []
+
+
+def _site(stat: tracemalloc.Statistic, size: int, count: int) -> Dict:
+    frame = stat.traceback[0]
+    return dict(site=f"{frame.filename}:{frame.lineno}", size=size, count=count)
+
+
+class MemoryTracker:
+    """
+    Records the peak memory allocated by Python while converting each page,
+    and within each stage of the conversion, like the Markdown conversion
+    and each Markdown processor, using `tracemalloc`.
+
+    Peaks are measured above the memory in use when a page or stage starts.
+    Since `tracemalloc` has a single peak, nested scopes fold the peak into
+    all open scopes before it is reset. On Python 3.8, where the peak cannot
+    be reset, a scope only sees the peak if it is the highest so far, and
+    otherwise the memory in use when the scope starts and ends.
+
+    A snapshot is taken when each page and stage starts and ends, and the
+    source lines whose allocations grew the most in between are kept for the
+    pages and stages with the highest peaks. Snapshots are taken between
+    resets of the peak, so their own memory is not counted.
+    """
+
+    def __init__(self, root_dir: pathlib.Path):
+        self.root_dir = root_dir
+        self.scopes: List[_Scope] = []
+        self.pages: Dict[str, Dict] = {}
+        self.stages: Dict[str, Dict] = {}
+        self.retained: Dict[str, int] = {}
+        self.current_page: Optional[str] = None
+        self.peak = 0
+        self.site_pages: List[str] = []
+        tracemalloc.start(TRACEBACK_FRAMES)
+
+    def _fold(self) -> int:
+        current, peak = tracemalloc.get_traced_memory()
+        if _reset_peak is None and peak <= self.peak:
+            peak = current
+        self.peak = max(self.peak, peak)
+        for scope in self.scopes:
+            scope.peak = max(scope.peak, peak)
+        if _reset_peak is not None:
+            _reset_peak()
+        return current
+
+    def _snapshot(self) -> tracemalloc.Snapshot:
+        # Only called right after folding the peak, which is then reset again
+        # to leave out the memory used by the snapshot
+        snapshot = tracemalloc.take_snapshot().filter_traces(_filters)
+        if _reset_peak is not None:
+            _reset_peak()
+        return snapshot
+
+    @contextlib.contextmanager
+    def _scope(self, name: str):
+        self._fold()
+        before = self._snapshot()
+        scope = _Scope(name, tracemalloc.get_traced_memory()[0])
+        self.scopes.append(scope)
+        try:
+            yield scope
+        finally:
+            current = self._fold()
+            self.scopes.pop()
+            scope.retained = current - scope.start
+            stats = self._snapshot().compare_to(before, "lineno")
+            stats.sort(key=lambda stat: -stat.size_diff)
+            scope.sites = [
+                _site(stat, stat.size_diff, stat.count_diff)
+                for stat in stats[:SCOPE_SITES]
+                if stat.size_diff > 0
+            ]
+
+    @contextlib.contextmanager
+    def page(self, path: pathlib.Path):
+        """
+        Record the memory used while converting the page at `path`.
+        """
+        name = path.relative_to(self.root_dir).as_posix()
+        self.current_page = name
+        self.pages[name] = dict(peak=0, stages={})
+        try:
+            with self._scope(name) as scope:
+                yield
+        finally:
+            self.current_page = None
+        self.pages[name]["peak"] = scope.peak - scope.start
+        self._keep_page_sites(name, scope.sites)
+
+    def _keep_page_sites(self, name: str, sites: List[Dict]):
+        """
+        Keep the allocation sites of the page `name` if it is one of the pages
+        with the highest peaks so far.
+        """
+        self.pages[name]["sites"] = sites
+        self.site_pages.append(name)
+        self.site_pages.sort(key=lambda page: -self.pages[page]["peak"])
+        for page in self.site_pages[SITE_PAGES:]:
+            del self.pages[page]["sites"]
+        del self.site_pages[SITE_PAGES:]
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """
+        Record the memory used by a stage of the conversion of a page, or of
+        the whole build outside pages.
+        """
+        with self._scope(name) as scope:
+            yield
+        peak = scope.peak - scope.start
+        page = self.current_page
+        if page is not None:
+            stages = self.pages[page]["stages"]
+            stages[name] = max(stages.get(name, 0), peak)
+        else:
+            self.retained[name] = scope.retained
+        stage = self.stages.setdefault(
+            name, dict(peak=0, page=None, runs=0, sites=[])
+        )
+        stage["runs"] += 1
+        if peak > stage["peak"]:
+            stage.update(peak=peak, page=page, sites=scope.sites)
+
+    def retained_sites(self, count: int = 10) -> List[Dict]:
+        """
+        Return the source lines with the most memory still allocated at this
+        point, such as caches kept for the rest of the build. These are not
+        necessarily the lines that caused the peaks of pages and stages.
+        """
+        snapshot = tracemalloc.take_snapshot().filter_traces(_filters)
+        return [
+            _site(stat, stat.size, stat.count)
+            for stat in snapshot.statistics("lineno")[:count]
+        ]
+
+    def summary(self) -> Dict:
+        self._fold()
+        return dict(
+            peak=self.peak,
+            retained=self.retained,
+            stages=self.stages,
+            pages=self.pages,
+            retained_sites=self.retained_sites(),
+        )
+
+    def write(self, path: pathlib.Path) -> Dict:
+        """
+        Stop tracing and write the summary as JSON to `path`.
+
+        Returns:
+            The summary.
+        """
+        summary = self.summary()
+        tracemalloc.stop()
+        path.write_text(json.dumps(summary, indent=2))
+        return summary
@@ -0,0 +1,114 @@
+import re
+
+from typing import Optional, Pattern
+
+
+# HTML whitespace, which does not include non-breaking and other Unicode spaces
+_whitespace = " \t\n\r\f"
+_whitespace_pattern = re.compile(f"[{_whitespace}]+")
+_tag_name_pattern = re.compile(r"<([a-zA-Z][a-zA-Z0-9]*)")
+
+# Elements whose content is passed through untouched
+RAW_TAGS = {"pre", "code", "textarea", "script", "style"}
+_raw_end_patterns = {tag: re.compile(f"</{tag}", re.IGNORECASE) for tag in RAW_TAGS}
+
+
+def _collapse(match):
+    return "\n" if "\n" in match.group() else " "
+
+
+class Minifier:
+    """
+    Single pass HTML minifier that can be fed the output in chunks.
+
+    Runs of whitespace in text are collapsed to a single newline or space, and
+    comments other than conditional comments are removed. The content of the
+    `RAW_TAGS` elements is left untouched.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.raw_end: Optional[Pattern] = None
+        self.in_comment = False
+
+    def feed(self, chunk: str) -> str:
+        """
+        Add a chunk of HTML and return the minified output that is ready.
+        """
+        self.buffer += chunk
+        return self._process(final=False)
+
+    def close(self) -> str:
+        """
+        Return the rest of the minified output.
+        """
+        return self._process(final=True)
+
+    def _process(self, final: bool) -> str:
+        out = []
+        buf = self.buffer
+        pos = 0
+        while pos < len(buf):
+            if self.raw_end:
+                match = self.raw_end.search(buf, pos)
+                if not match:
+                    # Hold back what could be the start of the end tag
+                    keep = 0 if final else len(self.raw_end.pattern)
+                    end = max(pos, len(buf) - keep)
+                    out.append(buf[pos:end])
+                    pos = end
+                    break
+                out.append(buf[pos : match.start()])
+                pos = match.start()
+                self.raw_end = None
+            elif self.in_comment:
+                end = buf.find("-->", pos)
+                if end < 0:
+                    pos = len(buf) if final else max(pos, len(buf) - 2)
+                    break
+                pos = end + 3
+                self.in_comment = False
+            else:
+                start = buf.find("<", pos)
+                if start < 0:
+                    text = buf[pos:]
+                    if not final:
+                        # Whitespace may continue in the next chunk
+                        text = text.rstrip(_whitespace)
+                    out.append(_whitespace_pattern.sub(_collapse, text))
+                    pos += len(text)
+                    break
+                out.append(_whitespace_pattern.sub(_collapse, buf[pos:start]))
+                pos = start
+                if not final and len(buf) - start < len("<!--[if"):
+                    break
+                if buf.startswith("<!--", start) and not buf.startswith(
+                    "<!--[if", start
+                ):
+                    self.in_comment = True
+                    pos = start + 4
+                    continue
+                end = buf.find(">", start)
+                if end < 0:
+                    if final:
+                        out.append(buf[start:])
+                        pos = len(buf)
+                    break
+                tag = buf[start : end + 1]
+                out.append(tag)
+                pos = end + 1
+                match = _tag_name_pattern.match(tag)
+                if match and not tag.endswith("/>"):
+                    name = match.group(1).lower()
+                    if name in RAW_TAGS:
+                        self.raw_end = _raw_end_patterns[name]
+        self.buffer = buf[pos:]
+        return "".join(out)
+
+
+def minify_html(html: str) -> str:
+    """
+    Minify a rendered HTML page.
+    """
+    minifier = Minifier()
+    return minifier.feed(html) + minifier.close()
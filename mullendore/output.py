@@ -0,0 +1,205 @@
+import io
+import os
+import pathlib
+import queue
+import shutil
+import tarfile
+import threading
+import time
+import zipfile
+
+from typing import List, Optional, Tuple, Union
+
+
+class FileWriter:
+    """
+    Writes output files to the file system.
+    """
+
+    def __init__(self, encoding: Optional[str] = None):
+        self.encoding = encoding or "utf-8"
+
+    def write(self, path: pathlib.Path, data: Union[str, bytes]):
+        if isinstance(data, str):
+            data = data.encode(self.encoding)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+
+    def copy(self, src: pathlib.Path, dest: pathlib.Path) -> bool:
+        """
+        Copy `src` to `dest`, unless `dest` is already up to date. Uses a hard
+        link when possible, and otherwise copies in the kernel if supported.
+
+        Returns:
+            Whether the file was copied.
+        """
+        src_stat = src.stat()
+        try:
+            dest_stat = dest.stat()
+            if os.path.samestat(src_stat, dest_stat) or (
+                src_stat.st_size == dest_stat.st_size
+                and src_stat.st_mtime <= dest_stat.st_mtime
+            ):
+                return False
+            dest.unlink()
+        except FileNotFoundError:
+            dest.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(src, dest)
+        except OSError:
+            _copy_file(src, dest, src_stat.st_size)
+        return True
+
+    def close(self):
+        pass
+
+
+def _copy_file(src: pathlib.Path, dest: pathlib.Path, size: int):
+    copy_file_range = getattr(os, "copy_file_range", None)
+    if copy_file_range is None:
+        shutil.copy2(src, dest)
+        return
+    with src.open("rb") as src_fh, dest.open("wb") as dest_fh:
+        try:
+            copied = 0
+            while copied < size:
+                count = copy_file_range(src_fh.fileno(), dest_fh.fileno(), size)
+                if not count:
+                    break
+                copied += count
+        except OSError:
+            src_fh.seek(0)
+            dest_fh.seek(0)
+            dest_fh.truncate()
+            shutil.copyfileobj(src_fh, dest_fh)
+    shutil.copystat(src, dest)
+
+
+class ArchiveWriter(FileWriter):
+    """
+    Writes output files into a single `.zip`, `.tar`, `.tar.gz`, `.tgz`,
+    `.tar.bz2` or `.tar.xz` archive, with member names relative to `root_dir`.
+    Files outside `root_dir` or written more than once are collected in
+    `errors` together with their path, and the incomplete archive is removed
+    when it is closed.
+    """
+
+    tar_modes = {
+        ".tar": "w",
+        ".tar.gz": "w:gz",
+        ".tgz": "w:gz",
+        ".tar.bz2": "w:bz2",
+        ".tar.xz": "w:xz",
+    }
+
+    def __init__(
+        self,
+        archive_path: pathlib.Path,
+        root_dir: pathlib.Path,
+        encoding: Optional[str] = None,
+    ):
+        super().__init__(encoding)
+        self.archive_path = archive_path
+        self.root_dir = root_dir
+        self.mtime = time.time()
+        self.names = set()
+        self.errors: List[Tuple[pathlib.Path, Exception]] = []
+        name = archive_path.name.lower()
+        if name.endswith(".zip"):
+            self.archive = zipfile.ZipFile(archive_path, "w", zipfile.ZIP_DEFLATED)
+            self.tar = False
+            return
+        for suffix, mode in self.tar_modes.items():
+            if name.endswith(suffix):
+                self.archive = tarfile.open(archive_path, mode)
+                self.tar = True
+                return
+        raise ValueError(f"{archive_path.name}: unsupported archive type")
+
+    def write(self, path: pathlib.Path, data: Union[str, bytes]):
+        if isinstance(data, str):
+            data = data.encode(self.encoding)
+        try:
+            name = path.relative_to(self.root_dir).as_posix()
+        except ValueError:
+            error = ValueError(f"{path} is outside of the archive root")
+            self.errors.append((path, error))
+            return
+        if name in self.names:
+            error = ValueError(f"{name} written more than once to the archive")
+            self.errors.append((path, error))
+            return
+        self.names.add(name)
+        if self.tar:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = self.mtime
+            info.mode = 0o644
+            self.archive.addfile(info, io.BytesIO(data))
+        else:
+            self.archive.writestr(name, data)
+
+    def copy(self, src: pathlib.Path, dest: pathlib.Path) -> bool:
+        self.write(dest, src.read_bytes())
+        return True
+
+    def close(self):
+        self.archive.close()
+        if self.errors:
+            self.archive_path.unlink()
+
+
+class QueuedWriter:
+    """
+    Hands writes over to another writer in a background thread. At most
+    `maxsize` writes are queued, after which callers wait.
+    Errors are collected in `errors` together with the path they concern.
+    """
+
+    def __init__(self, writer: FileWriter, maxsize: int = 16):
+        self.writer = writer
+        self.queue: queue.Queue = queue.Queue(maxsize)
+        self.errors: List[Tuple[pathlib.Path, Exception]] = []
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                break
+            path, data = item
+            try:
+                self.writer.write(path, data)
+            except Exception as e:
+                self.errors.append((path, e))
+            self.queue.task_done()
+
+    def write(self, path: pathlib.Path, data: Union[str, bytes]):
+        self.queue.put((path, data))
+
+    def copy(self, src: pathlib.Path, dest: pathlib.Path) -> bool:
+        # Copies are cheap, so wait for the queued writes and copy directly
+        self.queue.join()
+        return self.writer.copy(src, dest)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.writer.close()
+        self.errors.extend(getattr(self.writer, "errors", ()))
+
+
+def open_writer(
+    archive_path: Optional[pathlib.Path],
+    root_dir: pathlib.Path,
+    encoding: Optional[str] = None,
+) -> FileWriter:
+    """
+    Return an `ArchiveWriter` if `archive_path` is given, otherwise a
+    `FileWriter`.
+    """
+    if archive_path:
+        return ArchiveWriter(archive_path, root_dir, encoding)
+    return FileWriter(encoding)
@@ -0,0 +1,140 @@
+import bisect
+import collections
+import jinja2
+import pathlib
+
+from typing import Any, Dict, Hashable, List, Mapping, Optional, Tuple
+
+
+Page = Tuple[pathlib.Path, jinja2.Template]
+
+
+def _sort_key(path: pathlib.Path) -> Tuple[Tuple[str, ...], bool, str]:
+    return path.parent.parts, path.name != "index.md", path.name
+
+
+class PageIndex:
+    """
+    Indexes of the page metadata for listing pages, built once per build.
+
+    The pages are sorted by directory with `index.md` first, like the pages of
+    the build, so a directory subtree is a contiguous range. Indexes on metadata
+    keys are built the first time a key is queried, with a single pass over the
+    pages, and kept for the rest of the build. Queries then take time
+    proportional to the size of the result.
+    """
+
+    def __init__(self, pages: Mapping[pathlib.Path, jinja2.Template]):
+        entries = sorted(
+            (_sort_key(path.resolve()), path, template)
+            for path, template in pages.items()
+        )
+        self.keys = [key for key, _, _ in entries]
+        self.pages: List[Page] = [(path, template) for _, path, template in entries]
+        self.equal: Dict[str, Dict[Hashable, List[int]]] = {}
+        self.ordered: Dict[str, Tuple[List[Any], List[int], bool]] = {}
+
+    def _equal_index(self, key: str) -> Dict[Hashable, List[int]]:
+        index = self.equal.get(key)
+        if index is None:
+            index = self.equal[key] = collections.defaultdict(list)
+            for i, (_, template) in enumerate(self.pages):
+                value = template.metadata.get(key)
+                if value is None:
+                    continue
+                # A page listing several values, e.g. tags, is found by each
+                for item in value if isinstance(value, list) else (value,):
+                    try:
+                        index[item].append(i)
+                    except TypeError:
+                        continue
+        return index
+
+    def _ordered_index(self, key: str) -> Tuple[List[Any], List[int], bool]:
+        index = self.ordered.get(key)
+        if index is None:
+            entries = [
+                (template.metadata[key], i)
+                for i, (_, template) in enumerate(self.pages)
+                if template.metadata.get(key) is not None
+            ]
+            textual = False
+            try:
+                entries.sort()
+            except TypeError:
+                # Mixed types, such as dates and strings, sort by their text
+                textual = True
+                entries = sorted((str(value), i) for value, i in entries)
+            index = self.ordered[key] = (
+                [value for value, _ in entries],
+                [i for _, i in entries],
+                textual,
+            )
+        return index
+
+    def _subtree(self, directory: pathlib.Path) -> range:
+        parts = directory.resolve().parts
+        start = bisect.bisect_left(self.keys, (parts,))
+        # Sorts after the parts of every path in the directory tree
+        end = parts[:-1] + (parts[-1] + "\0",)
+        stop = bisect.bisect_left(self.keys, (end,), start)
+        return range(start, stop)
+
+    def _select(self, indices, under: Optional[pathlib.Path]) -> List[Page]:
+        if under is not None:
+            subtree = self._subtree(under)
+            indices = (i for i in indices if i in subtree)
+        return [self.pages[i] for i in indices]
+
+    def where(
+        self, key: str, value: Any, under: Optional[pathlib.Path] = None
+    ) -> List[Page]:
+        """
+        Return the pages whose metadata `key` is, or is a list containing,
+        `value`, in path order.
+        """
+        try:
+            indices = self._equal_index(key).get(value, ())
+        except TypeError:
+            indices = ()
+        return self._select(indices, under)
+
+    def by(
+        self,
+        key: str,
+        start: Any = None,
+        stop: Any = None,
+        reverse: bool = False,
+        under: Optional[pathlib.Path] = None,
+    ) -> List[Page]:
+        """
+        Return the pages that have metadata `key`, sorted by its value.
+        If given, only values in the range `start <= value < stop` are included.
+        """
+        values, indices, textual = self._ordered_index(key)
+        if textual:
+            start = None if start is None else str(start)
+            stop = None if stop is None else str(stop)
+        low = 0 if start is None else bisect.bisect_left(values, start)
+        high = len(values) if stop is None else bisect.bisect_left(values, stop)
+        selected = indices[low:high]
+        return self._select(reversed(selected) if reverse else selected, under)
+
+    def grouped_by(
+        self, key: str, under: Optional[pathlib.Path] = None
+    ) -> Dict[Hashable, List[Page]]:
+        """
+        Return the pages that have metadata `key` grouped by its values, with
+        pages listing several values in each of their groups.
+        """
+        groups = {
+            value: self._select(indices, under)
+            for value, indices in self._equal_index(key).items()
+        }
+        return {value: pages for value, pages in groups.items() if pages}
+
+    def under(self, directory: pathlib.Path) -> List[Page]:
+        """
+        Return the pages in `directory` and its subdirectories, in path order.
+        """
+        return [self.pages[i] for i in self._subtree(directory)]
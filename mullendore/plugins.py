@@ -4,6 +4,8 @@ import pathlib
 from typing import Callable, Optional, Union, Any
 
 from mullendore.markdown import markdown_to_html
+from mullendore.pages import PageIndex
+from mullendore.types import add_dependency
 
 Pathlike = Union[str, pathlib.Path]
 
@@ -44,7 +46,7 @@ def markdown(ctx: jinja2.runtime.Context, text: str) -> jinja2.Markup:
     Template filter for converting Markdown to HTML.
     """
     store = ctx["store"]
-    previously_in_markdown = store.get("in_markdown", False)
+    previously_in_markdown = store.peek("in_markdown", False)
     if not previously_in_markdown:
         store["in_markdown"] = True
         parent: Any = ctx.parent
@@ -94,6 +96,7 @@ def glob(
         path = here(ctx).joinpath(path)
     pattern = path.name
     path = path.parent
+    add_dependency(ctx, path)
     return (
         str(p.resolve())
         for p in sorted(path.glob(pattern))
@@ -116,9 +119,73 @@ def menu_links(ctx: jinja2.runtime.Context) -> str:
     return out
 
 
+def _page_index(ctx: jinja2.runtime.Context) -> PageIndex:
+    page_index = ctx.get("page_index")
+    if page_index is None:
+        page_index = PageIndex(ctx["pages"] or {})
+    return page_index
+
+
+def _directory(ctx: jinja2.runtime.Context, pathlike: Optional[Pathlike]):
+    if pathlike is None:
+        return None
+    path = pathlib.Path(pathlike)
+    return path if path.is_absolute() else here(ctx).joinpath(path)
+
+
+@template_function
+def pages_where(
+    ctx: jinja2.runtime.Context,
+    key: str,
+    value: Any,
+    under: Optional[Pathlike] = None,
+) -> list:
+    """
+    Return the `(path, page)` pairs of the pages whose metadata `key` is, or
+    lists, `value`. With `under`, only pages in that directory tree are included.
+    """
+    return _page_index(ctx).where(key, value, _directory(ctx, under))
+
+
+@template_function
+def pages_by(
+    ctx: jinja2.runtime.Context,
+    key: str,
+    start: Any = None,
+    stop: Any = None,
+    reverse: bool = False,
+    under: Optional[Pathlike] = None,
+) -> list:
+    """
+    Return the `(path, page)` pairs of the pages with metadata `key`, sorted by
+    its value and optionally limited to values from `start` up to `stop`.
+    """
+    return _page_index(ctx).by(key, start, stop, reverse, _directory(ctx, under))
+
+
+@template_function
+def pages_grouped_by(
+    ctx: jinja2.runtime.Context, key: str, under: Optional[Pathlike] = None
+) -> dict:
+    """
+    Return the `(path, page)` pairs of the pages with metadata `key`, grouped
+    by its values.
+    """
+    return _page_index(ctx).grouped_by(key, _directory(ctx, under))
+
+
+@template_function
+def pages_under(ctx: jinja2.runtime.Context, pathlike: Pathlike) -> list:
+    """
+    Return the `(path, page)` pairs of the pages in a directory tree.
+    """
+    return _page_index(ctx).under(_directory(ctx, pathlike))
+
+
 @template_function
 def list_files(ctx: jinja2.runtime.Context, pathlike: Pathlike) -> str:
     path = pathlib.Path(pathlike) if isinstance(pathlike, str) else pathlike
+    add_dependency(ctx, path)
     out = "<ul>\n"
     for filepath in sorted(path.glob("*")):
         if filepath.name.startswith("."):
@@ -138,6 +205,7 @@ def include_section(
     include_blockquotes: bool = False,
 ) -> str:
     path = pathlib.Path(pathlike) if isinstance(pathlike, str) else pathlike
+    add_dependency(ctx, path)
     out = []
     level = 0
     for line in path.read_text().splitlines():
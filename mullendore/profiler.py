@@ -0,0 +1,141 @@
+import collections
+import contextlib
+import jinja2
+import pathlib
+import sys
+import threading
+
+from typing import Counter, List, Optional, Tuple
+
+from mullendore.templates import Template, rendering
+
+
+_render_root_code = Template._render_root.__code__
+
+
+def _offset(template: jinja2.Template) -> int:
+    # Lines are counted after the YAML header, which is not part of the source
+    metadata = getattr(template, "metadata", None) or {}
+    own = getattr(metadata, "maps", [metadata])[0]
+    return own.get("metadata_linecount", 0)
+
+
+class TemplateProfiler:
+    """
+    Sampling profiler that attributes the time spent rendering pages to lines
+    of templates.
+
+    A background thread samples the stack of the rendering thread every
+    `interval` seconds while a page is rendered. Frames of compiled templates
+    are mapped back to the template name and source line with the debug info
+    Jinja keeps for them, time spent in a template outside its lines, such as
+    converting Markdown, is attributed to the template itself, other frames are
+    named by their module and function, and the frames of Jinja are left out.
+    """
+
+    def __init__(self, root_dir: pathlib.Path, interval: float = 0.001):
+        self.root_dir = root_dir
+        self.interval = interval
+        self.stacks: Counter[Tuple[str, ...]] = collections.Counter()
+        self.lines: Counter[str] = collections.Counter()
+        self.samples = 0
+        self.current: Optional[str] = None
+        self.thread_id = threading.get_ident()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    @contextlib.contextmanager
+    def page(self, path: pathlib.Path):
+        """
+        Sample the stack while rendering the page at `path`.
+        """
+        self.thread_id = threading.get_ident()
+        self.current = self._name(path)
+        try:
+            yield
+        finally:
+            self.current = None
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            page = self.current
+            frame = sys._current_frames().get(self.thread_id)
+            templates = list(rendering.get(self.thread_id, ()))
+            if page is not None and frame is not None:
+                self._sample(page, frame, templates)
+
+    def _sample(self, page: str, frame, templates: List[jinja2.Template]):
+        frames = []
+        while frame is not None:
+            if frame.f_globals.get("__name__") == "mullendore.convert":
+                break
+            frames.append(frame)
+            frame = frame.f_back
+        # The templates are pushed and popped inside the frames of
+        # _render_root, so the two can differ while a template starts or
+        # finishes. Such samples are skipped.
+        roots = sum(1 for frame in frames if frame.f_code is _render_root_code)
+        if roots != len(templates):
+            return
+        stack = []
+        hot_line = None
+        for frame in frames:
+            module = frame.f_globals.get("__name__") or ""
+            template = frame.f_globals.get("__jinja_template__")
+            if template is not None:
+                lineno = template.get_corresponding_lineno(frame.f_lineno)
+                lineno += _offset(template)
+                label = f"{self._template_name(template)}:{lineno}"
+                hot_line = hot_line or label
+                stack.append(label)
+            elif frame.f_code is _render_root_code:
+                # Time spent outside template lines, e.g. converting Markdown.
+                # The frames match the templates being rendered, innermost
+                # first.
+                label = self._template_name(templates.pop())
+                hot_line = hot_line or label
+                stack.append(label)
+            elif module != "jinja2" and not module.startswith("jinja2."):
+                stack.append(f"{module}.{frame.f_code.co_name}")
+        stack.append(page)
+        self.stacks[tuple(reversed(stack))] += 1
+        self.lines[hot_line or page] += 1
+        self.samples += 1
+
+    def _template_name(self, template: jinja2.Template) -> str:
+        filepath = getattr(template, "filepath", None)
+        if filepath is None:
+            return self._name(template.name)
+        return self._name(filepath, template.name)
+
+    def _name(self, path, default: Optional[str] = None) -> str:
+        try:
+            name = pathlib.Path(path).relative_to(self.root_dir).as_posix()
+        except ValueError:
+            name = default or str(path)
+        # Semicolons separate the frames in the collapsed stacks
+        return name.replace(";", ",")
+
+    def write(self, path: pathlib.Path):
+        """
+        Write the samples as collapsed stacks, one `frame;frame;... count` line
+        per distinct stack, which flame graph tools can read.
+        """
+        path.write_text(
+            "".join(
+                f"{';'.join(stack)} {count}\n"
+                for stack, count in sorted(self.stacks.items())
+            )
+        )
+
+    def hot_lines(self, count: int = 20) -> List[Tuple[str, int]]:
+        """
+        Return the template lines sampled most often, as the innermost template
+        frame, with their number of samples.
+        """
+        return self.lines.most_common(count)
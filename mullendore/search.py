@@ -0,0 +1,114 @@
+import collections
+import gzip
+import html
+import json
+import pathlib
+import re
+
+from typing import Dict, List, Optional, Tuple
+
+from mullendore.markdown import header_name
+from mullendore.output import FileWriter
+
+
+_html_tag_pattern = re.compile(r"<[^>]*>")
+_html_header_id_pattern = re.compile(r'<h[1-6][^>]* id="(.*?)"')
+_term_pattern = re.compile(r"\w\w+")
+
+Postings = Dict[str, List[int]]
+
+
+class SearchIndex:
+    """
+    Inverted index of the rendered pages, built incrementally while converting.
+
+    The index is written as a small `index.json` with the documents and their
+    anchors, and a gzipped JSON shard per term prefix. Each shard maps terms to
+    a flat list of `document, anchor, count` triplets, so a client only loads
+    the shards for the terms it searches for.
+    """
+
+    def __init__(self, root_dir: pathlib.Path, prefix_length: int = 2):
+        self.root_dir = root_dir
+        self.prefix_length = prefix_length
+        self.docs: List[Tuple[str, Optional[str], List[Tuple[str, str]]]] = []
+        self.shards: Dict[str, Postings] = collections.defaultdict(
+            lambda: collections.defaultdict(list)
+        )
+
+    def add(
+        self,
+        path: pathlib.Path,
+        text: str,
+        toc: Optional[List[Tuple[int, str, str]]] = None,
+        title: Optional[str] = None,
+        filename: Optional[str] = None,
+    ):
+        """
+        Add the HTML `text` converted from the page at `path` to the index,
+        splitting it into sections at the header anchors listed in `toc`.
+        The `filename` of the output, if given, replaces the page's own.
+        """
+        target = path.with_name(filename) if filename else path.with_suffix(".html")
+        url = f"/{target.relative_to(self.root_dir)}"
+        names = {anchor: header_name(name) for _, anchor, name in toc or ()}
+        anchors = [("", title or "")]
+        doc = len(self.docs)
+        self.docs.append((url, title, anchors))
+        pos = 0
+        for match in _html_header_id_pattern.finditer(text):
+            self._add_section(doc, len(anchors) - 1, text[pos : match.start()])
+            anchors.append((match.group(1), names.get(match.group(1), "")))
+            pos = match.start()
+        self._add_section(doc, len(anchors) - 1, text[pos:])
+
+    def _add_section(self, doc: int, anchor: int, text: str):
+        text = html.unescape(_html_tag_pattern.sub(" ", text)).lower()
+        for term, count in collections.Counter(_term_pattern.findall(text)).items():
+            self.shards[term[: self.prefix_length]][term].extend((doc, anchor, count))
+
+    def write(self, out_dir: pathlib.Path, writer: FileWriter) -> List[pathlib.Path]:
+        """
+        Write the index files to `out_dir` using `writer`.
+
+        Returns:
+            List of the paths written.
+        """
+        # Documents are numbered by URL, so that the index does not depend on
+        # the order the pages were converted in
+        order = sorted(range(len(self.docs)), key=lambda doc: self.docs[doc][0])
+        numbers = {doc: number for number, doc in enumerate(order)}
+        docs = [self.docs[doc] for doc in order]
+        written = []
+        for prefix, postings in sorted(self.shards.items()):
+            shard_path = out_dir.joinpath(f"{prefix}.json.gz")
+            postings = {
+                term: [
+                    value
+                    for triplet in sorted(
+                        (numbers[flat[i]], flat[i + 1], flat[i + 2])
+                        for i in range(0, len(flat), 3)
+                    )
+                    for value in triplet
+                ]
+                for term, flat in sorted(postings.items())
+            }
+            data = json.dumps(postings, separators=(",", ":"), ensure_ascii=False)
+            # Zero mtime makes the output reproducible between builds
+            writer.write(shard_path, gzip.compress(data.encode(), mtime=0))
+            written.append(shard_path)
+        index_path = out_dir.joinpath("index.json")
+        writer.write(
+            index_path,
+            json.dumps(
+                dict(
+                    prefix_length=self.prefix_length,
+                    docs=docs,
+                    shards=sorted(self.shards),
+                ),
+                separators=(",", ":"),
+                ensure_ascii=False,
+            ).encode(),
+        )
+        written.append(index_path)
+        return written
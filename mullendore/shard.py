@@ -0,0 +1,130 @@
+import hashlib
+import json
+import pathlib
+
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
+
+Manifest = Dict
+Timings = Mapping[str, float]
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """
+    Parse a shard specification on the form `i/N`, where `1 <= i <= N`.
+
+    Raises:
+        ValueError: If the specification is invalid.
+    """
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise ValueError(f"expected a shard on the form i/N, not '{value}'")
+    if not 1 <= index <= count:
+        raise ValueError(f"shard index must be between 1 and {count}")
+    return index, count
+
+
+def partition(
+    paths: Iterable[pathlib.Path],
+    root_dir: pathlib.Path,
+    index: int,
+    count: int,
+    timings: Optional[Timings] = None,
+) -> List[pathlib.Path]:
+    """
+    Return the paths that belong to shard `index` of `count`.
+
+    Without timings, pages are assigned by a stable hash of their path relative
+    to `root_dir`, so every machine computes the same partition. With timings
+    from a previous build, pages are instead assigned longest first to the
+    least loaded shard. Pages without a recorded timing count as the average.
+    """
+    paths = list(paths)
+    names = {path: path.relative_to(root_dir).as_posix() for path in paths}
+    if not timings:
+        return [path for path in paths if _hash(names[path]) % count == index - 1]
+    default = sum(timings.values()) / len(timings)
+    costs = {path: timings.get(names[path], default) for path in paths}
+    loads = [0.0] * count
+    selected = set()
+    for path in sorted(paths, key=lambda path: (-costs[path], names[path])):
+        shard = min(range(count), key=lambda i: (loads[i], i))
+        loads[shard] += costs[path]
+        if shard == index - 1:
+            selected.add(path)
+    return [path for path in paths if path in selected]
+
+
+def _hash(name: str) -> int:
+    return int.from_bytes(hashlib.sha1(name.encode()).digest()[:8], "big")
+
+
+def build_manifest(
+    shard: Optional[Tuple[int, int]],
+    root_dir: pathlib.Path,
+    outputs: Mapping[pathlib.Path, pathlib.Path],
+    timings: Mapping[pathlib.Path, float],
+    out_dir: Optional[pathlib.Path] = None,
+) -> Manifest:
+    """
+    Build a manifest of the converted pages, their outputs and render timings,
+    with paths relative to `root_dir`, or outputs relative to `out_dir` if given.
+    """
+    return dict(
+        shard=list(shard) if shard else [1, 1],
+        pages={
+            path.relative_to(root_dir).as_posix(): dict(
+                output=output.relative_to(out_dir or root_dir).as_posix(),
+                time=round(timings.get(path, 0.0), 4),
+            )
+            for path, output in outputs.items()
+        },
+    )
+
+
+def read_timings(manifest_path: pathlib.Path) -> Dict[str, float]:
+    """
+    Read the page timings from a manifest written by a previous build.
+    """
+    manifest = json.loads(manifest_path.read_text())
+    return {name: page["time"] for name, page in manifest["pages"].items()}
+
+
+def merge_manifests(manifests: Iterable[Manifest]) -> Manifest:
+    """
+    Validate and combine the partial manifests written by sharded builds.
+
+    Raises:
+        ValueError: If shards are missing, duplicated, disagree on the shard
+            count or overlap in pages or outputs.
+    """
+    manifests = list(manifests)
+    if not manifests:
+        raise ValueError("no manifests given")
+    count = manifests[0]["shard"][1]
+    seen: Dict[int, Manifest] = {}
+    for manifest in manifests:
+        index, shard_count = manifest["shard"]
+        if shard_count != count:
+            raise ValueError(f"shard {index}/{shard_count} is not one of {count}")
+        if index in seen:
+            raise ValueError(f"shard {index}/{count} given more than once")
+        seen[index] = manifest
+    missing = sorted(set(range(1, count + 1)) - set(seen))
+    if missing:
+        raise ValueError(f"missing shards: {', '.join(map(str, missing))}")
+    pages: Dict[str, Dict] = {}
+    outputs: Dict[str, str] = {}
+    for index, manifest in sorted(seen.items()):
+        for name, page in manifest["pages"].items():
+            if name in pages:
+                raise ValueError(f"{name}: converted by more than one shard")
+            if page["output"] in outputs:
+                raise ValueError(
+                    f"{name}: output {page['output']} also written by "
+                    f"{outputs[page['output']]}"
+                )
+            pages[name] = page
+            outputs[page["output"]] = name
+    return dict(shard=[1, 1], pages=dict(sorted(pages.items())))
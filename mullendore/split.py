@@ -0,0 +1,135 @@
+import pathlib
+import re
+
+from typing import Dict, List, Optional, Tuple
+
+from mullendore.markdown import header_name
+
+Toc = List[Tuple[int, str, str]]
+
+
+def split_level(toc: Toc, level: Optional[int] = None) -> Optional[int]:
+    """
+    Return the header level of the top-level sections in `toc`. This is the
+    highest level in use, unless it is only used once, like for the title of
+    the document, in which case it is the next level. Returns None if the
+    title is the only header.
+    """
+    if level is not None or not toc:
+        return level
+    levels = sorted({header_level for header_level, _, _ in toc})
+    level = levels[0]
+    if sum(1 for entry in toc if entry[0] == level) == 1:
+        if len(levels) == 1:
+            return None
+        level = levels[1]
+    return level
+
+
+def section_files(toc: Toc, level: int, path: pathlib.Path) -> Dict[str, str]:
+    """
+    Return the name of the file each header anchor in `toc` ends up in when the
+    page at `path` is split into a file per section at `level`. Headers before
+    the first section stay in the page itself.
+    """
+    files = {}
+    name = path.with_suffix(".html").name
+    started = False
+    for header_level, anchor, _ in toc:
+        if header_level == level or (started and header_level < level):
+            started = True
+            name = f"{path.stem}-{anchor}.html"
+        files[anchor] = name
+    return files
+
+
+class SplitPage:
+    """
+    A page rendered to a file per top-level section.
+
+    The page is rendered once per file, with this object as `split_page` in
+    the context. The first rendering converts the whole Markdown text and
+    splits the HTML, the following ones reuse the parts. The page itself keeps
+    the text before the first section and links to the sections, and each
+    section gets links to the previous and next sections and the page. The
+    TOC links point to the file of each header.
+    """
+
+    def __init__(
+        self,
+        path: pathlib.Path,
+        level: Optional[int] = None,
+        title: Optional[str] = None,
+    ):
+        self.path = path
+        self.level = level
+        self.title = title or path.stem
+        self.files: Dict[str, str] = {}
+        self.sections: List[Tuple[str, str]] = []
+        self.parts: Optional[List[str]] = None
+        self.toc: Optional[Toc] = None
+        self.current = 0
+
+    @property
+    def paths(self) -> List[pathlib.Path]:
+        """
+        Paths of the page and its section files.
+        """
+        return [self.path] + [
+            self.path.with_name(self.files[anchor]) for anchor, _ in self.sections
+        ]
+
+    @property
+    def filename(self) -> str:
+        """
+        Name of the file of the part being rendered.
+        """
+        return self.paths[self.current].name
+
+    def split(self, text: str, toc: Optional[Toc]):
+        """
+        Split the HTML `text` converted from the page, with headers `toc`.
+        """
+        self.toc = toc
+        self.level = split_level(toc or [], self.level)
+        if self.level is None:
+            self.parts = [text]
+            return
+        self.files = section_files(toc, self.level, self.path)
+        positions = []
+        pos = 0
+        previous = self.path.name
+        for _, anchor, name in toc:
+            if self.files[anchor] == previous:
+                continue
+            previous = self.files[anchor]
+            match = re.compile(f'<h[1-6] id="{re.escape(anchor)}"').search(text, pos)
+            if not match:
+                continue
+            self.sections.append((anchor, header_name(name)))
+            positions.append(match.start())
+            pos = match.end()
+        bounds = [0] + positions + [len(text)]
+        parts = [text[start:end] for start, end in zip(bounds, bounds[1:])]
+        if not self.sections:
+            self.parts = parts
+            return
+        links = "".join(
+            f'<li><a href="{self.files[anchor]}">{name}</a></li>\n'
+            for anchor, name in self.sections
+        )
+        parts[0] += f'\n<ul class="split-sections">\n{links}</ul>\n'
+        for i in range(1, len(parts)):
+            parts[i] += self._nav(i)
+        self.parts = parts
+
+    def _nav(self, i: int) -> str:
+        links = []
+        if i > 1:
+            anchor, name = self.sections[i - 2]
+            links.append(f'<a rel="prev" href="{self.files[anchor]}">{name}</a>')
+        links.append(f'<a href="{self.path.name}">{self.title}</a>')
+        if i < len(self.sections):
+            anchor, name = self.sections[i]
+            links.append(f'<a rel="next" href="{self.files[anchor]}">{name}</a>')
+        return f'\n<nav class="split-nav">\n{" ".join(links)}\n</nav>\n'
@@ -1,53 +1,99 @@
+import concurrent.futures
+import hashlib
+import io
 import pathlib
+import re
+import threading
 import jinja2
+import jinja2.ext
 import yaml
-import wrapt
 
-from typing import Iterable, Tuple, Callable, Optional, Dict, TextIO
+from jinja2.utils import concat
+from types import CodeType
+
+from typing import Iterable, Tuple, Callable, Optional, Dict, List, TextIO
 
 from mullendore.markdown import markdown_to_html
+from mullendore.types import add_dependency
 
 
-class Template(wrapt.ObjectProxy):
-    def __init__(self, *args, **kwargs):
-        wrapt.ObjectProxy.__init__(self, *args, **kwargs)
-        self.metadata = None
-        self.filepath = None
-        self.page = False
-
-    def render(self, **ctx):
-        ctx["store"].setdefault("here", [])
-        ctx["store"]["here"].append(self)
-        previously_in_markdown = ctx["store"].get("in_markdown", False)
-        if self.filename.endswith(".md") and not previously_in_markdown:
-            ctx["store"]["in_markdown"] = True
-            result = self.__wrapped__.render(**ctx)
-            result = markdown_to_html(result, ctx)
-            ctx["store"]["in_markdown"] = False
-        else:
-            result = self.__wrapped__.render(**ctx)
-        ctx["store"]["here"].pop()
-        return result
-
-    def root_render_func(self, ctx):
-        ctx["store"].setdefault("here", [])
-        ctx["store"]["here"].append(self)
-        previously_in_markdown = ctx["store"].get("in_markdown", False)
-        if self.filename.endswith(".md") and not previously_in_markdown:
-            ctx["store"]["in_markdown"] = True
-            result = jinja2.utils.concat(self.__wrapped__.root_render_func(ctx))
-            result = markdown_to_html(result, ctx)
-            ctx["store"]["in_markdown"] = False
-        else:
-            result = jinja2.utils.concat(self.__wrapped__.root_render_func(ctx))
-        ctx["store"]["here"].pop()
-        return result
+# Line breaks that only some Jinja versions split template source at
+_other_line_breaks = re.compile("[\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]")
+_newline_pattern = re.compile(r"\r\n|\r|\n")
+
+# Templates being rendered by each thread, innermost last, which other threads
+# such as the profiler can read
+rendering: Dict[int, List["Template"]] = {}
+
+
+class Template(jinja2.Template):
+    """
+    Template class used by `Environment`. Keeps track of the currently rendered
+    templates for `here()`, and converts the output of templates whose name
+    ends with the `.md` suffix from Markdown to HTML.
+    """
+
+    metadata = None
+    filepath = None
+    page = False
+    plain = False
+
+    @classmethod
+    def from_text(cls, environment, text, name, filename, globals, uptodate):
+        """
+        Create a template that outputs `text` as it is, without compiling it.
+        The text must not contain any template syntax.
+        """
+        # Drop a single trailing newline and normalize the others, like the
+        # Jinja lexer
+        for newline in ("\r\n", "\r", "\n"):
+            if text.endswith(newline):
+                text = text[: -len(newline)]
+                break
+        text = _newline_pattern.sub(environment.newline_sequence, text)
+        namespace = dict(
+            name=name,
+            __file__=filename,
+            blocks={},
+            debug_info="",
+            root=lambda ctx: iter((text,)),
+        )
+        template = cls._from_namespace(environment, namespace, globals)
+        template._uptodate = uptodate
+        template.plain = True
+        return template
 
-    def new_context(self, vars=None, shared=False, locals=None):
-        if vars is None:
-            vars = {}
-        ctx = self.__wrapped__.new_context(vars=vars, shared=shared, locals=locals)
-        return ctx
+    @classmethod
+    def _from_namespace(cls, environment, namespace, globals):
+        template = super()._from_namespace(environment, namespace, globals)
+        filename = template.filename or ""
+        template.markdown = filename.endswith(".md")
+        template._root_render_func = template.root_render_func
+        template.root_render_func = template._render_root
+        return template
+
+    def _render_root(self, ctx):
+        stack = rendering.setdefault(threading.get_ident(), [])
+        try:
+            stack.append(self)
+            store = ctx["store"]
+            here = store.peek("here")
+            if here is None:
+                here = store["here"] = []
+            here.append(self)
+            if self.filepath:
+                add_dependency(ctx, self.filepath)
+            if self.markdown and not store.peek("in_markdown", False):
+                store["in_markdown"] = True
+                result = concat(self._root_render_func(ctx))
+                result = markdown_to_html(result, ctx)
+                store["in_markdown"] = False
+            else:
+                result = concat(self._root_render_func(ctx))
+            here.pop()
+        finally:
+            stack.pop()
+        yield result
 
 
 class Context(jinja2.runtime.Context):
@@ -63,7 +109,90 @@ class Context(jinja2.runtime.Context):
 jinja2.Environment.context_class = Context
 
 
+class FragmentCache:
+    """
+    Rendered template fragments from `{% cache %}` blocks, kept for the build
+    and optionally stored as files in `path`.
+    """
+
+    def __init__(self, path: Optional[pathlib.Path] = None):
+        self.path = path
+        self.fragments: Dict[str, str] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[str]:
+        fragment = self.fragments.get(key)
+        if fragment is None and self.path:
+            try:
+                fragment = self.path.joinpath(f"{key}.html").read_text()
+                self.fragments[key] = fragment
+            except OSError:
+                pass
+        if fragment is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return fragment
+
+    def set(self, key: str, fragment: str):
+        self.fragments[key] = fragment
+        if self.path:
+            self.path.mkdir(parents=True, exist_ok=True)
+            self.path.joinpath(f"{key}.html").write_text(fragment)
+
+
+class FragmentCacheExtension(jinja2.ext.Extension):
+    """
+    Adds a `{% cache key, ... %}...{% endcache %}` tag that renders its body
+    once per distinct combination of key values and template source, and then
+    reuses the HTML. Any side effects of the body, such as storing the TOC, are
+    skipped when the fragment is reused.
+    """
+
+    tags = {"cache"}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=FragmentCache())
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        keys = [parser.parse_expression()]
+        while parser.stream.skip_if("comma"):
+            keys.append(parser.parse_expression())
+        body = parser.parse_statements(["name:endcache"], drop_needle=True)
+        source_key = f"{parser.name}:{lineno}:{self._source_digest(parser.name)}"
+        return jinja2.nodes.CallBlock(
+            self.call_method(
+                "_render_cached",
+                [jinja2.nodes.Const(source_key), jinja2.nodes.List(keys)],
+            ),
+            [],
+            [],
+            body,
+        ).set_lineno(lineno)
+
+    def _source_digest(self, name: Optional[str]) -> str:
+        find_path = getattr(self.environment.loader, "find_path", None)
+        path = find_path(name) if find_path and name else None
+        if not path:
+            return ""
+        return hashlib.sha1(path.read_bytes()).hexdigest()
+
+    def _render_cached(self, source_key: str, keys: list, caller) -> str:
+        cache = self.environment.fragment_cache
+        key = hashlib.sha1(repr((source_key, keys)).encode()).hexdigest()
+        fragment = cache.get(key)
+        if fragment is None:
+            fragment = caller()
+            cache.set(key, fragment)
+        return jinja2.Markup(fragment)
+
+
 class Environment(jinja2.Environment):
+    template_class = Template
+
     def join_path(self, template, parent):
         if parent:
             parent_path = self.loader.find_path(parent)
@@ -89,6 +218,35 @@ class Loader(jinja2.BaseLoader):
         self.root_file: Optional[pathlib.Path] = None
         self.root_dir: Optional[pathlib.Path] = None
         self.loadinfo = []
+        self.sources: Dict[pathlib.Path, str] = {}
+        self.prefetched: Dict[pathlib.Path, concurrent.futures.Future] = {}
+        self.executor: Optional[concurrent.futures.Executor] = None
+        # Compiled code of templates outside `site_root`, which may be shared
+        # with the loaders of other sites
+        self.site_root: Optional[pathlib.Path] = None
+        self.code_cache: Dict[Tuple[pathlib.Path, str, str], CodeType] = {}
+
+    def add_source(self, path: pathlib.Path, source: str):
+        """
+        Load the template at `path` from `source` instead of the file system.
+        """
+        self.sources[path] = source
+
+    def remove_source(self, path: pathlib.Path):
+        self.sources.pop(path, None)
+
+    def prefetch(self, paths: Iterable[pathlib.Path]):
+        """
+        Start reading the files at `paths` in background threads, so that the
+        following loads of them do not wait for the file system.
+        """
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(4)
+        for path in paths:
+            if path not in self.prefetched:
+                self.prefetched[path] = self.executor.submit(
+                    path.read_text, encoding=self.encoding
+                )
 
     def set_root_file(self, path: pathlib.Path):
         self.root_file = path
@@ -103,7 +261,7 @@ class Loader(jinja2.BaseLoader):
 
     def find_path(self, name: str) -> pathlib.Path:
         path = pathlib.Path(name)
-        if path.is_absolute() and path.is_file():
+        if path.is_absolute() and (path in self.sources or path.is_file()):
             return path
         for searchpath in self.searchpath:
             tmp = searchpath.joinpath(path)
@@ -118,8 +276,20 @@ class Loader(jinja2.BaseLoader):
         if not path:
             raise jinja2.exceptions.TemplateNotFound(template)
 
-        with path.open(mode="r", encoding=self.encoding) as fh:
-            self.loadinfo.append((path, self._read_yaml_header(fh)))
+        if path in self.sources:
+            source = self.sources[path]
+            fh = io.StringIO(source)
+            self.loadinfo.append((path, self._read_yaml_header(fh, path)))
+            contents = fh.read()
+            return contents, template, lambda: self.sources.get(path) is source
+
+        future = self.prefetched.pop(path, None)
+        if future is not None:
+            fh = io.StringIO(future.result())
+        else:
+            fh = path.open(mode="r", encoding=self.encoding)
+        with fh:
+            self.loadinfo.append((path, self._read_yaml_header(fh, path)))
             contents = fh.read()
 
         mtime = path.stat().st_mtime
@@ -133,18 +303,65 @@ class Loader(jinja2.BaseLoader):
         return contents, template, uptodate
 
     @jinja2.utils.internalcode
-    def load(self, *args, **kwargs):
-        template = Template(jinja2.BaseLoader.load(self, *args, **kwargs))
+    def load(self, environment, name, globals=None):
+        if globals is None:
+            globals = {}
+        source, filename, uptodate = self.get_source(environment, name)
+        if self._is_plain(environment, source):
+            template = environment.template_class.from_text(
+                environment, source, name, filename, globals, uptodate
+            )
+        else:
+            code = self._compile(environment, source, name, filename)
+            template = environment.template_class.from_code(
+                environment, code, globals, uptodate
+            )
         loadinfo = self.loadinfo.pop()
         if not loadinfo:
             raise RuntimeError("Template loaded without path or metadata")
         template.filepath, template.metadata = loadinfo
         return template
 
-    def _read_yaml_header(self, fh: TextIO) -> Dict:
+    def _compile(
+        self, environment: jinja2.Environment, source: str, name: str, filename: str
+    ) -> CodeType:
+        path = self.loadinfo[-1][0].resolve()
+        if self.site_root is not None and self.site_root in path.parents:
+            return environment.compile(source, name, filename)
+        # Templates outside the site, like the built-in ones, compile the same
+        # for every site
+        key = (path, name, source)
+        code = self.code_cache.get(key)
+        if code is None:
+            code = self.code_cache[key] = environment.compile(source, name, filename)
+        return code
+
+    @staticmethod
+    def _is_plain(environment: jinja2.Environment, source: str) -> bool:
+        if environment.keep_trailing_newline or environment.line_statement_prefix:
+            return False
+        if environment.line_comment_prefix or _other_line_breaks.search(source):
+            return False
+        return not any(
+            delimiter in source
+            for delimiter in (
+                environment.block_start_string,
+                environment.variable_start_string,
+                environment.comment_start_string,
+            )
+        )
+
+    def read_metadata(self, path: pathlib.Path) -> Dict:
+        """
+        Read the metadata in the YAML header of the file at `path`.
+        """
+        with path.open(mode="r", encoding=self.encoding) as fh:
+            return self._read_yaml_header(fh, path)
+
+    def _read_yaml_header(self, fh: TextIO, path: pathlib.Path) -> Dict:
         if fh.readline() != "---\n":
             fh.seek(0)
-            return 0, {}
+            return {}
         blob = ""
         linecount = 1
         while True:
@@ -155,7 +372,7 @@ class Loader(jinja2.BaseLoader):
             blob += line
         metadata = yaml.safe_load(blob)
         metadata["metadata_linecount"] = linecount
-        metadata = self._process_metadata(metadata, fh.name)
+        metadata = self._process_metadata(metadata, str(path))
         return metadata
 
     @staticmethod
@@ -0,0 +1,84 @@
+import click
+import json
+import pathlib
+
+from typing import Dict, Iterable, List, Mapping, Tuple
+
+from mullendore.shard import Timings, read_timings
+
+
+# Pages are reported as slower when they take this many times as long...
+REGRESSION_FACTOR = 1.5
+# ...and at least this many seconds longer than in the previous build
+REGRESSION_MINIMUM = 0.05
+
+
+def load_timings(path: pathlib.Path) -> Dict[str, float]:
+    """
+    Read the page timings kept at `path`, or none if there is no such file or
+    it cannot be read.
+    """
+    try:
+        return read_timings(path)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+        click.echo(f"{path}: ignoring unreadable timings: {e}", err=True)
+        return {}
+
+
+def save_timings(
+    path: pathlib.Path,
+    root_dir: pathlib.Path,
+    previous: Timings,
+    timings: Mapping[pathlib.Path, float],
+):
+    """
+    Write the page timings of a build to `path`, keeping the previous timings
+    of pages that were not converted. The file has the same form as a
+    manifest, so it can also be used to balance shards.
+    """
+    pages = {name: dict(time=time) for name, time in previous.items()}
+    for page_path, time in timings.items():
+        pages[page_path.relative_to(root_dir).as_posix()] = dict(time=round(time, 4))
+    path.write_text(json.dumps(dict(pages=dict(sorted(pages.items()))), indent=2))
+
+
+def order_by_cost(
+    paths: Iterable[pathlib.Path], root_dir: pathlib.Path, timings: Timings
+) -> List[pathlib.Path]:
+    """
+    Return `paths` ordered longest first by their previous timings. Pages
+    without a timing count as the average, and ties keep their order.
+    """
+    paths = list(paths)
+    if not timings:
+        return paths
+    default = sum(timings.values()) / len(timings)
+    costs = {
+        path: timings.get(path.relative_to(root_dir).as_posix(), default)
+        for path in paths
+    }
+    return sorted(paths, key=lambda path: -costs[path])
+
+
+def slowest(timings: Timings, count: int = 10) -> List[Tuple[str, float]]:
+    """
+    Return the `count` slowest pages with their timings.
+    """
+    return sorted(timings.items(), key=lambda item: (-item[1], item[0]))[:count]
+
+
+def regressions(previous: Timings, timings: Timings) -> List[Tuple[str, float, float]]:
+    """
+    Return the pages that got significantly slower since the previous build,
+    with their previous and current timings, most slowed down first.
+    """
+    slower = [
+        (name, previous[name], time)
+        for name, time in timings.items()
+        if name in previous
+        and time >= previous[name] * REGRESSION_FACTOR
+        and time - previous[name] >= REGRESSION_MINIMUM
+    ]
+    return sorted(slower, key=lambda item: (item[1] - item[2], item[0]))
@@ -1,6 +1,8 @@
 import collections
 import pathlib
 
+from typing import Callable, Dict, Mapping, Set
+
 
 def path(s):
     return pathlib.Path(s)
@@ -39,3 +41,57 @@ class Metadata(collections.ChainMap):
             return True
         except KeyError:
             return False
+
+
+class PageStore(dict):
+    """
+    Values shared by the templates and Markdown processors of a page.
+
+    Values set with `set_lazy` are computed by their function when first read,
+    and the keys that were read are recorded in `used`. Bookkeeping that is
+    not a use of the value, like checking whether Markdown is being
+    converted, reads with `peek` instead.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy: Dict[str, Callable] = {}
+        self.used: Set[str] = set()
+
+    def set_lazy(self, key: str, func: Callable):
+        self.pop(key, None)
+        self.lazy[key] = func
+
+    def __missing__(self, key):
+        value = self[key] = self.lazy.pop(key)()
+        return value
+
+    def __getitem__(self, key):
+        self.used.add(key)
+        return super().__getitem__(key)
+
+    def __contains__(self, key):
+        return super().__contains__(key) or key in self.lazy
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def peek(self, key, default=None):
+        """
+        Return the value of `key` without computing or recording it.
+        """
+        return super().get(key, default)
+
+
+def add_dependency(ctx: Mapping, path: pathlib.Path):
+    """
+    Record that the page being rendered depends on the file or directory at
+    `path`, if the context tracks `dependencies`. Directories keep pages from
+    being cached, since their contents are not tracked.
+    """
+    dependencies = ctx.get("dependencies")
+    if dependencies is not None:
+        dependencies.add(path)